@@ -0,0 +1,173 @@
+import sqlite3
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from llm_cache import normalize_query
+
+
+class AnalyticsRollups:
+    """Daily rollups of recommendation logs, kept in their own SQLite database.
+
+    The log writer feeds every batch it writes to ``update``, which
+    aggregates it in memory and upserts the per-day counters, so dashboard
+    queries read a few small tables instead of scanning and parsing the raw
+    logs, and never touch the serving database.
+    """
+
+    BUDGET_BUCKETS = ((0, 'no budget'), (500, '≤ ₹500'), (1000, '₹501-1000'), (2000, '₹1001-2000'),
+                      (5000, '₹2001-5000'))
+
+    def __init__(self, db_path: str = "analytics.sqlite"):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as conn:
+            self._create_tables(conn)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _create_tables(self, conn: sqlite3.Connection):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS query_rollup (
+                day TEXT NOT NULL,
+                query_key TEXT NOT NULL,
+                query TEXT NOT NULL,
+                requests INTEGER NOT NULL,
+                PRIMARY KEY (day, query_key)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS product_rollup (
+                day TEXT NOT NULL,
+                product_id INTEGER NOT NULL,
+                impressions INTEGER NOT NULL,
+                confidence_sum REAL NOT NULL,
+                PRIMARY KEY (day, product_id)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS category_rollup (
+                day TEXT NOT NULL,
+                category TEXT NOT NULL,
+                impressions INTEGER NOT NULL,
+                confidence_sum REAL NOT NULL,
+                PRIMARY KEY (day, category)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS budget_rollup (
+                day TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                requests INTEGER NOT NULL,
+                PRIMARY KEY (day, bucket)
+            )
+        ''')
+
+    def budget_bucket(self, budget_max) -> str:
+        """Label of the budget range a request's budget_max falls in"""
+        if not isinstance(budget_max, (int, float)) or budget_max <= 0:
+            return 'no budget'
+        for upper, label in self.BUDGET_BUCKETS[1:]:
+            if budget_max <= upper:
+                return label
+        return '> ₹5000'
+
+    def update(self, records: List):
+        """Fold a batch of log writer records into the rollups"""
+        queries, query_text, budgets = Counter(), {}, Counter()
+        products, product_confidence = Counter(), Counter()
+        categories, category_confidence = Counter(), Counter()
+
+        for timestamp, user_query, preferences, product_ids, scores, product_categories in records:
+            day = timestamp[:10]
+            key = normalize_query(user_query)
+            queries[day, key] += 1
+            query_text.setdefault((day, key), user_query)
+            budgets[day, self.budget_bucket(preferences.get('budget_max'))] += 1
+            for product_id, score, category in zip(product_ids, scores, product_categories):
+                score = score or 0
+                if product_id is not None:
+                    products[day, product_id] += 1
+                    product_confidence[day, product_id] += score
+                if category:
+                    categories[day, category] += 1
+                    category_confidence[day, category] += score
+
+        with self._connect() as conn:
+            conn.executemany('''
+                INSERT INTO query_rollup (day, query_key, query, requests) VALUES (?, ?, ?, ?)
+                ON CONFLICT (day, query_key) DO UPDATE SET requests = requests + excluded.requests
+            ''', [(day, key, query_text[day, key], count) for (day, key), count in queries.items()])
+            conn.executemany('''
+                INSERT INTO product_rollup (day, product_id, impressions, confidence_sum) VALUES (?, ?, ?, ?)
+                ON CONFLICT (day, product_id) DO UPDATE SET
+                    impressions = impressions + excluded.impressions,
+                    confidence_sum = confidence_sum + excluded.confidence_sum
+            ''', [(day, product_id, count, product_confidence[day, product_id])
+                  for (day, product_id), count in products.items()])
+            conn.executemany('''
+                INSERT INTO category_rollup (day, category, impressions, confidence_sum) VALUES (?, ?, ?, ?)
+                ON CONFLICT (day, category) DO UPDATE SET
+                    impressions = impressions + excluded.impressions,
+                    confidence_sum = confidence_sum + excluded.confidence_sum
+            ''', [(day, category, count, category_confidence[day, category])
+                  for (day, category), count in categories.items()])
+            conn.executemany('''
+                INSERT INTO budget_rollup (day, bucket, requests) VALUES (?, ?, ?)
+                ON CONFLICT (day, bucket) DO UPDATE SET requests = requests + excluded.requests
+            ''', [(day, bucket, count) for (day, bucket), count in budgets.items()])
+
+    # Queries
+
+    @staticmethod
+    def _since(days: int) -> str:
+        return (datetime.now(timezone.utc).date() - timedelta(days=max(1, days) - 1)).isoformat()
+
+    def _rows(self, query: str, params) -> List[Dict]:
+        cursor = self._connect().execute(query, params)
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def top_queries(self, days: int = 7, limit: int = 20) -> List[Dict]:
+        """Most frequent (normalized) queries over the last ``days`` days"""
+        return self._rows('''
+            SELECT query_key, MIN(query) AS query, SUM(requests) AS requests
+            FROM query_rollup WHERE day >= ?
+            GROUP BY query_key ORDER BY requests DESC, query_key LIMIT ?
+        ''', (self._since(days), limit))
+
+    def product_impressions(self, days: int = 7, limit: int = 20) -> List[Dict]:
+        """Products recommended most often, with their average confidence"""
+        return self._rows('''
+            SELECT product_id, SUM(impressions) AS impressions,
+                   ROUND(SUM(confidence_sum) / SUM(impressions), 2) AS avg_confidence
+            FROM product_rollup WHERE day >= ?
+            GROUP BY product_id ORDER BY impressions DESC, product_id LIMIT ?
+        ''', (self._since(days), limit))
+
+    def category_confidence(self, days: int = 7) -> List[Dict]:
+        """Average confidence of recommended products per product category"""
+        return self._rows('''
+            SELECT category, SUM(impressions) AS impressions,
+                   ROUND(SUM(confidence_sum) / SUM(impressions), 2) AS avg_confidence
+            FROM category_rollup WHERE day >= ?
+            GROUP BY category ORDER BY impressions DESC, category
+        ''', (self._since(days),))
+
+    def budget_distribution(self, days: int = 7) -> List[Dict]:
+        """Requests per budget range"""
+        order = {label: position for position, (_, label) in enumerate(self.BUDGET_BUCKETS)}
+        rows = self._rows('''
+            SELECT bucket, SUM(requests) AS requests
+            FROM budget_rollup WHERE day >= ?
+            GROUP BY bucket
+        ''', (self._since(days),))
+        return sorted(rows, key=lambda row: order.get(row['bucket'], len(order)))
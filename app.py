@@ -150,6 +150,86 @@ def call_api(endpoint: str, method: str = "GET", data: Dict = None) -> Dict:
         st.error(f"Error calling API: {str(e)}")
         return None
 
+def stream_api(endpoint: str, data: Dict):
+    """Yield (event, payload) pairs from a server-sent events endpoint"""
+    try:
+        url = f"{API_BASE_URL}/{endpoint}"
+        
+        with requests.post(url, json=data, stream=True, headers={"Accept": "text/event-stream"}) as response:
+            if response.status_code != 200:
+                st.error(f"API Error: {response.status_code} - {response.text}")
+                return
+            
+            response.encoding = "utf-8"
+            event, data_lines = None, []
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data_lines.append(line[len("data:"):].strip())
+                elif not line and data_lines:
+                    # A blank line terminates the event
+                    yield event or "message", json.loads("\n".join(data_lines))
+                    event, data_lines = None, []
+    except requests.exceptions.ConnectionError:
+        st.error("Cannot connect to the API server. Please ensure the FastAPI server is running on port 8000.")
+    except Exception as e:
+        st.error(f"Error calling API: {str(e)}")
+
+def fetch_products(params: Dict) -> Dict:
+    """GET /products, revalidating pages already fetched with their ETag"""
+    cache = st.session_state.setdefault('product_pages', {})
+    key = json.dumps(params, sort_keys=True)
+    etag, cached = cache.get(key, (None, None))
+    try:
+        response = requests.get(
+            f"{API_BASE_URL}/products", params=params,
+            headers={"If-None-Match": etag} if etag else {}
+        )
+        if response.status_code == 304:
+            return cached
+        if response.status_code == 200:
+            page = response.json()
+            cache[key] = (response.headers.get("ETag"), page)
+            return page
+        st.error(f"API Error: {response.status_code} - {response.text}")
+    except requests.exceptions.ConnectionError:
+        st.error("Cannot connect to the API server. Please ensure the FastAPI server is running on port 8000.")
+    except Exception as e:
+        st.error(f"Error calling API: {str(e)}")
+    return None
+
+def display_browse(category: str):
+    """Page through a category with only the columns the table shows"""
+    sort_options = {"Top rated": "-rating", "Price: low to high": "price", "Price: high to low": "-price", "Name": "name"}
+    sort_label = st.selectbox("Sort by", list(sort_options), key="browse_sort")
+    
+    # Cursors of the pages shown so far; reset when the category or sort changes
+    state = (category, sort_options[sort_label])
+    if st.session_state.get('browse_state') != state:
+        st.session_state.browse_state = state
+        st.session_state.browse_cursors = [None]
+    
+    products, next_cursor = [], None
+    for cursor in st.session_state.browse_cursors:
+        params = {"category": category, "sort": sort_options[sort_label], "limit": 20,
+                  "fields": "name,brand,subcategory,price,rating"}
+        if cursor:
+            params["cursor"] = cursor
+        page = fetch_products(params)
+        if not page:
+            break
+        products.extend(page["products"])
+        next_cursor = page["next_cursor"]
+    
+    if products:
+        st.dataframe(products, hide_index=True, use_container_width=True)
+    else:
+        st.info("No products in this category yet.")
+    if next_cursor and st.button("Load more", key="browse_more"):
+        st.session_state.browse_cursors.append(next_cursor)
+        st.rerun()
+
 def display_product_card(product: Dict):
     """Display a product card with information"""
     confidence = product.get('confidence', 0)
@@ -309,23 +389,44 @@ def main():
                         'content': user_input
                     })
                     
-                    # Get recommendations from API
-                    with st.spinner("Finding perfect recommendations for you..."):
-                        result = call_api("recommend", "POST", {
-                            "query": user_input,
-                            "user_id": st.session_state.user_id
+                    # Stream recommendations from API: preferences, then
+                    # product cards, then Mitra's response token by token
+                    status = st.empty()
+                    status.info("Finding perfect recommendations for you...")
+                    response_placeholder = st.empty()
+                    products_placeholder = st.container()
+                    ai_response = ""
+                    completed = False
+                    
+                    for event, payload in stream_api("recommend/stream", {
+                        "query": user_input,
+                        "user_id": st.session_state.user_id
+                    }):
+                        if event == "preferences":
+                            st.session_state.current_preferences = payload
+                            status.info("Ranking products for you...")
+                        elif event == "products":
+                            st.session_state.current_recommendations = payload
+                            status.empty()
+                            with products_placeholder:
+                                for product in payload[:6]:
+                                    display_product_card(product)
+                        elif event == "token":
+                            ai_response += payload
+                            response_placeholder.markdown(f'<div class="assistant-message">{ai_response}</div>', unsafe_allow_html=True)
+                        elif event == "done":
+                            ai_response = payload['ai_response']
+                            completed = True
+                        elif event == "error":
+                            status.empty()
+                            st.error(payload['detail'])
+                    
+                    if completed:
+                        # Add assistant response to chat history
+                        st.session_state.chat_history.append({
+                            'role': 'assistant',
+                            'content': ai_response
                         })
-                        
-                        if result:
-                            # Add assistant response to chat history
-                            st.session_state.chat_history.append({
-                                'role': 'assistant',
-                                'content': result['ai_response']
-                            })
-                            
-                            # Store recommendations for display
-                            st.session_state.current_recommendations = result['recommendations']
-                            st.session_state.current_preferences = result['preferences_extracted']
                     
                     # Clear the current query
                     if 'current_query' in st.session_state:
@@ -399,6 +500,12 @@ def main():
                     if st.button(f"Add to Cart", key=f"cart_{recommendations[i + 1]['id']}"):
                         st.success(f"Added {recommendations[i + 1]['name']} to cart!")
     
+    # Browse the category picked in the sidebar
+    if st.session_state.get('browse_category'):
+        st.markdown("---")
+        st.header(f"Browse {st.session_state.browse_category.title()}")
+        display_browse(st.session_state.browse_category)
+    
     # Footer
     st.markdown("---")
     st.markdown("""
@@ -0,0 +1,474 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from database import split_tags
+from retrieval import BM25Index
+from text_matching import SubstringIndex
+
+# Set bits per byte value, for counting bits in uint64 bitsets viewed as bytes
+_POPCOUNT8 = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def _object_array(values: Sequence) -> np.ndarray:
+    """1-D object array, even when values are themselves sequences"""
+    array = np.empty(len(values), dtype=object)
+    array[:] = list(values)
+    return array
+
+
+class CatalogSnapshot:
+    """Immutable columnar copy of the product catalog.
+
+    Price, rating and availability are NumPy columns; category, subcategory
+    and brand are integer codes into small vocabularies; tags are parsed once
+    into tag ids (CSR ``tag_offsets``/``tag_ids`` plus per-product bitsets)
+    and lowercased term tuples, next to lowercased names, so scoring never
+    splits or lowercases strings per request. Filters are mask operations
+    over these columns, and product dicts are only built for the rows that
+    are actually returned.
+
+    Records are either rows (tuples, with ``columns`` naming their fields) as
+    read from SQLite, or product dicts as passed around by callers.
+
+    For browsing, each sortable field gets a (key, id) sort order built the
+    first time it is asked for; pages are keyset slices of that order.
+    """
+
+    SORT_FIELDS = ('id', 'price', 'rating', 'name')
+
+    def __init__(self, records: List, columns: Optional[List[str]] = None, version: int = 0):
+        self.version = version
+        self.records = records
+        self.columns = columns
+        n = len(records)
+
+        self._positions = None
+        self._sort_values = {}
+        self._tag_index = None
+        self._text_index = None
+        self._id_order = None
+        self._index_lock = threading.Lock()
+        self._orders = {}
+        if columns is not None:
+            positions = self._positions = {name: position for position, name in enumerate(columns)}
+
+            def field(name, default=None):
+                if name not in positions:
+                    return [default] * n
+                position = positions[name]
+                return [record[position] for record in records]
+        else:
+            def field(name, default=None):
+                return [record.get(name, default) for record in records]
+
+        self.ids = np.array([-1 if value is None else value for value in field('id')], dtype=np.int64)
+        self.prices = np.array(field('price'), dtype=float)
+        self.ratings = np.array(field('rating', 3), dtype=float)
+        self.available = np.array([bool(value) for value in field('availability', True)], dtype=bool)
+        self.names = _object_array(field('name', ''))
+        self.names_lower = _object_array([(name or '').lower() for name in self.names])
+        self.tags = _object_array(field('tags'))
+        self.descriptions = _object_array(field('description'))
+
+        self._vocabularies = {}
+        self.category_codes, self.categories = self._encode('category', field('category'))
+        self.subcategory_codes, self.subcategories = self._encode('subcategory', field('subcategory'))
+        self.brand_codes, self.brands = self._encode('brand', field('brand'))
+
+        self._parse_tags(self.tags)
+
+    def _encode(self, field: str, values: List):
+        """Integer codes for values plus the distinct values they index into"""
+        vocabulary = {}
+        codes = np.fromiter(
+            (vocabulary.setdefault(value, len(vocabulary)) for value in values),
+            dtype=np.int32, count=len(values)
+        )
+        self._vocabularies[field] = vocabulary
+        return codes, _object_array(list(vocabulary))
+
+    def _parse_tags(self, tags: np.ndarray):
+        """Tag vocabulary (lowercased tag -> id), per-product tag ids and term tuples, and bitsets"""
+        vocabulary = {}
+        terms, offsets, ids = [], [0], []
+        for raw in tags:
+            product_terms = tuple(split_tags(raw))
+            terms.append(product_terms)
+            ids.extend(vocabulary.setdefault(tag, len(vocabulary)) for tag in product_terms)
+            offsets.append(len(ids))
+
+        self.tag_vocabulary = vocabulary
+        self.tag_names = _object_array(list(vocabulary))
+        self.tag_terms = _object_array(terms)
+        self.tag_offsets = np.array(offsets, dtype=np.int64)
+        self.tag_ids = np.array(ids, dtype=np.int32)
+        self.tag_bits = self._tag_bitsets(self.tag_offsets, self.tag_ids, len(vocabulary))
+
+    @staticmethod
+    def _tag_bitsets(offsets: np.ndarray, tag_ids: np.ndarray, vocabulary_size: int) -> np.ndarray:
+        """One uint64 bitset row per product from CSR tag ids"""
+        bitsets = np.zeros((len(offsets) - 1, max(1, (vocabulary_size + 63) // 64)), dtype=np.uint64)
+        if len(tag_ids):
+            rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+            bits = tag_ids.astype(np.uint64)
+            np.bitwise_or.at(
+                bitsets,
+                (rows, (bits >> np.uint64(6)).astype(np.intp)),
+                np.uint64(1) << (bits & np.uint64(63))
+            )
+        return bitsets
+
+    def with_product(self, product_id: int, record, version: int) -> "CatalogSnapshot":
+        """Copy of the snapshot with one product replaced, added or (record None) removed.
+
+        Only the edited record is parsed; the other rows' columns are spliced
+        over, and a built text index is patched rather than rebuilt. Assumes
+        rows in id order, as ``DatabaseManager.load_catalog`` reads them.
+        """
+        part = CatalogSnapshot([] if record is None else [record], self.columns, version)
+        start = int(np.searchsorted(self.ids, product_id))
+        stop = start + int(start < len(self.ids) and self.ids[start] == product_id)
+
+        def splice(old, new):
+            return np.concatenate([old[:start], new, old[stop:]])
+
+        snapshot = object.__new__(CatalogSnapshot)
+        snapshot.version = version
+        snapshot.records = self.records[:start] + part.records + self.records[stop:]
+        snapshot.columns = self.columns
+        snapshot._positions = self._positions
+        snapshot._sort_values = {}
+        snapshot._id_order = None
+        snapshot._index_lock = threading.Lock()
+        snapshot._orders = {}
+        for name in ('ids', 'prices', 'ratings', 'available', 'names', 'names_lower', 'tags', 'descriptions',
+                     'tag_terms'):
+            setattr(snapshot, name, splice(getattr(self, name), getattr(part, name)))
+
+        snapshot._vocabularies = {}
+        for field, codes, values in (('category', 'category_codes', 'categories'),
+                                     ('subcategory', 'subcategory_codes', 'subcategories'),
+                                     ('brand', 'brand_codes', 'brands')):
+            vocabulary = dict(self._vocabularies[field])
+            new_codes = [vocabulary.setdefault(value, len(vocabulary))
+                         for value in getattr(part, values)[getattr(part, codes)]]
+            snapshot._vocabularies[field] = vocabulary
+            setattr(snapshot, codes, splice(getattr(self, codes), np.array(new_codes, dtype=np.int32)))
+            setattr(snapshot, values, _object_array(list(vocabulary)))
+
+        vocabulary = dict(self.tag_vocabulary)
+        new_ids = np.array([vocabulary.setdefault(tag, len(vocabulary)) for terms in part.tag_terms for tag in terms],
+                           dtype=np.int32)
+        old_start, old_stop = self.tag_offsets[start], self.tag_offsets[stop]
+        snapshot.tag_vocabulary = vocabulary
+        snapshot.tag_names = _object_array(list(vocabulary)) if len(vocabulary) > len(self.tag_vocabulary) else self.tag_names
+        snapshot.tag_ids = np.concatenate([self.tag_ids[:old_start], new_ids, self.tag_ids[old_stop:]])
+        snapshot.tag_offsets = np.concatenate([
+            self.tag_offsets[:start + 1], old_start + part.tag_offsets[1:],
+            self.tag_offsets[stop + 1:] - old_stop + old_start + len(new_ids)
+        ])
+        width = max(1, (len(vocabulary) + 63) // 64)
+        tag_bits = self.tag_bits
+        if width > tag_bits.shape[1]:
+            tag_bits = np.pad(tag_bits, ((0, 0), (0, width - tag_bits.shape[1])))
+        snapshot.tag_bits = splice(tag_bits, self._tag_bitsets(part.tag_offsets, new_ids, len(vocabulary)))
+
+        snapshot._tag_index = self._tag_index if snapshot.tag_names is self.tag_names else None
+        snapshot._text_index = None
+        if self._text_index is not None:
+            snapshot._text_index = self._text_index.replace(start, stop, part._text_documents())
+        return snapshot
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def code(self, field: str, value) -> int:
+        """Integer code of a category/subcategory/brand value, -1 if it never occurs"""
+        try:
+            return self._vocabularies[field].get(value, -1)
+        except TypeError:  # unhashable preference value
+            return -1
+
+    def tag_mask(self, tags) -> Optional[np.ndarray]:
+        """Bitset of the requested tags, or None if one of them is not in the catalog"""
+        mask = np.zeros(self.tag_bits.shape[1], dtype=np.uint64)
+        for tag in split_tags(tags):
+            bit = self.tag_vocabulary.get(tag)
+            if bit is None:
+                return None
+            mask[bit >> 6] |= np.uint64(1) << np.uint64(bit & 63)
+        return mask
+
+    def rows_of(self, product_ids: np.ndarray) -> np.ndarray:
+        """Snapshot row of each product id, -1 for ids not in the snapshot"""
+        if self._id_order is None:
+            self._id_order = np.argsort(self.ids, kind='stable')
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        if not len(self.ids):
+            return np.full(len(product_ids), -1, dtype=np.int64)
+        sorted_ids = self.ids[self._id_order]
+        positions = np.minimum(np.searchsorted(sorted_ids, product_ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[positions] == product_ids, self._id_order[positions], -1)
+
+    def tag_index(self) -> SubstringIndex:
+        """Substring index over the tag vocabulary, built on first use"""
+        if self._tag_index is None:
+            with self._index_lock:
+                if self._tag_index is None:
+                    self._tag_index = SubstringIndex(list(self.tag_vocabulary))
+        return self._tag_index
+
+    def text_index(self) -> BM25Index:
+        """BM25 index over name, tags, brand and description, built on first use.
+
+        Name and tags are repeated so that they weigh more than the description.
+        """
+        if self._text_index is None:
+            with self._index_lock:
+                if self._text_index is None:
+                    self._text_index = BM25Index(self._text_documents())
+        return self._text_index
+
+    def _text_documents(self) -> List[str]:
+        return [
+            f"{name} {name} {' '.join(tags)} {' '.join(tags)} {brand or ''} {description or ''}"
+            for name, tags, brand, description in zip(
+                self.names_lower, self.tag_terms, self.brands[self.brand_codes], self.descriptions
+            )
+        ]
+
+    def tag_id_mask(self, tag_ids) -> np.ndarray:
+        """Bitset with the given tag ids set"""
+        mask = np.zeros(self.tag_bits.shape[1], dtype=np.uint64)
+        for bit in tag_ids:
+            mask[bit >> 6] |= np.uint64(1) << np.uint64(bit & 63)
+        return mask
+
+    def product(self, i: int) -> Dict:
+        """Full product dict for row i"""
+        record = self.records[i]
+        if self.columns is None:
+            return dict(record)
+        return dict(zip(self.columns, record))
+
+    def project(self, i: int, fields: Sequence[str]) -> Dict:
+        """Only the given fields of row i"""
+        record = self.records[i]
+        if self._positions is None:
+            return {field: record.get(field) for field in fields}
+        return {field: record[self._positions[field]] for field in fields}
+
+    def sort_values(self, field: str) -> np.ndarray:
+        """Per-row values of a sort field"""
+        values = self._sort_values.get(field)
+        if values is None:
+            values = self._sort_values[field] = self._build_sort_values(field)
+        return values
+
+    def _build_sort_values(self, field: str) -> np.ndarray:
+        if field == 'id':
+            return self.ids
+        if field == 'price':
+            return self.prices
+        if field == 'rating':
+            return np.nan_to_num(self.ratings)  # NULL ratings sort as 0, the column default
+        if field == 'name':
+            return np.array([name or '' for name in self.names], dtype=str)
+        raise ValueError(f"cannot sort by {field}")
+
+    def sort_order(self, field: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Rows sorted by (field, id), with their sorted keys and ids; built once per snapshot"""
+        order = self._orders.get(field)
+        if order is None:
+            values = self.sort_values(field)
+            rows = np.lexsort((self.ids, values))
+            order = self._orders[field] = (rows, values[rows], self.ids[rows])
+        return order
+
+    def page(self, keep: np.ndarray, sort: str = 'id', descending: bool = False,
+             after: Optional[Tuple] = None, limit: int = 50) -> Tuple[np.ndarray, Optional[Tuple]]:
+        """Up to ``limit`` rows where ``keep`` holds, in (sort, id) order, strictly after the
+        ``after`` (key, id) cursor; returns the rows and the cursor of the next page (None at the end)"""
+        rows, keys, ids = self.sort_order(sort)
+        if after is None:
+            start = len(rows) if descending else 0
+        else:
+            key, last_id = after
+            lo, hi = np.searchsorted(keys, key, 'left'), np.searchsorted(keys, key, 'right')
+            start = lo + np.searchsorted(ids[lo:hi], last_id, 'left' if descending else 'right')
+
+        candidates = rows[:start][::-1] if descending else rows[start:]
+        hits = candidates[keep[candidates]][:limit + 1]
+        if len(hits) <= limit:
+            return hits, None
+        last = hits[limit - 1]
+        return hits[:limit], (self.sort_values(sort)[last].item(), int(self.ids[last]))
+
+    def matching(self, category: Optional[str] = None, max_price: Optional[float] = None,
+                 tags: Optional[List[str]] = None) -> np.ndarray:
+        """Boolean mask over all rows of the available products matching the filters"""
+        return self.available & self.view().mask(category, max_price, tags)
+
+    def view(self, rows: Optional[np.ndarray] = None) -> "CatalogView":
+        return CatalogView(self, np.arange(len(self)) if rows is None else rows)
+
+    def select(self, category: Optional[str] = None, max_price: Optional[float] = None,
+               tags: Optional[List[str]] = None) -> "CatalogView":
+        """Available products matching the filters, in catalog order"""
+        available = self.view(np.flatnonzero(self.available))
+        return available.subset(available.mask(category, max_price, tags))
+
+
+class CatalogView:
+    """A subset of a snapshot's rows, indexable like a list of product dicts"""
+
+    def __init__(self, snapshot: CatalogSnapshot, rows: np.ndarray):
+        self.snapshot = snapshot
+        self.rows = rows
+
+    @classmethod
+    def of(cls, products) -> "CatalogView":
+        """products as a view, building a throwaway snapshot for a plain list of dicts"""
+        if isinstance(products, CatalogView):
+            return products
+        return CatalogSnapshot(list(products)).view()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, i: int) -> Dict:
+        return self.snapshot.product(self.rows[i])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def to_list(self) -> List[Dict]:
+        return [self[i] for i in range(len(self))]
+
+    def column(self, name: str) -> np.ndarray:
+        """A snapshot column (e.g. 'prices', 'category_codes') restricted to this view"""
+        return getattr(self.snapshot, name)[self.rows]
+
+    def mask(self, category: Optional[str] = None, max_price: Optional[float] = None,
+             tags: Optional[List[str]] = None) -> np.ndarray:
+        """Boolean mask of the rows matching the same filters as DatabaseManager.get_products"""
+        snapshot = self.snapshot
+        keep = np.ones(len(self.rows), dtype=bool)
+
+        if category:
+            keep &= snapshot.category_codes[self.rows] == snapshot.code('category', category)
+        if max_price:
+            keep &= snapshot.prices[self.rows] <= max_price
+        if split_tags(tags):
+            required = snapshot.tag_mask(tags)
+            if required is None:
+                keep[:] = False
+            else:
+                # Only test the rows still in, against the words that hold a required bit
+                survivors = np.flatnonzero(keep)
+                words = np.flatnonzero(required)
+                bits = snapshot.tag_bits[self.rows[survivors][:, None], words]
+                keep[survivors] = ((bits & required[words]) == required[words]).all(axis=1)
+
+        return keep
+
+    def tag_counts(self, tag_ids) -> np.ndarray:
+        """How many of the given tags each row has: a bitset intersection and popcount
+        over only the bitset words that hold one of them"""
+        mask = self.snapshot.tag_id_mask(tag_ids)
+        words = np.flatnonzero(mask)
+        if not len(words) or not len(self.rows):
+            return np.zeros(len(self.rows), dtype=np.int64)
+        bits = self.snapshot.tag_bits[self.rows[:, None], words] & mask[words]
+        return _POPCOUNT8[bits.view(np.uint8)].reshape(len(self.rows), -1).sum(axis=1, dtype=np.int64)
+
+    def subset(self, keep: np.ndarray) -> "CatalogView":
+        return CatalogView(self.snapshot, self.rows[keep])
+
+
+class Catalog:
+    """Process-wide catalog snapshot, reloaded when the database catalog version changes.
+
+    The version is polled at most every ``poll_seconds``; when it moved, a
+    background thread loads the new snapshot and builds its search indexes
+    while requests keep using the current one, so edits made by other
+    workers show up shortly after that interval. Edits made through this
+    process call ``apply`` (one product, patched in) or ``refresh`` (full
+    reload) and are visible when those return. ``on_reload``, when set, is
+    called with each snapshot a background reload publishes.
+    """
+
+    def __init__(self, db_manager, poll_seconds: Optional[float] = None):
+        self.db_manager = db_manager
+        # Settings are read here, not in the signature, so a .env loaded after import applies
+        self.poll_seconds = poll_seconds if poll_seconds is not None else float(os.getenv("CATALOG_POLL_SECONDS", 1.0))
+        self._lock = threading.Lock()
+        self._load_lock = threading.RLock()  # one snapshot build at a time
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._reloading = False
+        self.on_reload = None
+
+    def current(self) -> CatalogSnapshot:
+        """Latest snapshot; starts a background reload if the catalog version moved"""
+        if self._snapshot is None:
+            with self._load_lock:
+                if self._snapshot is None:
+                    self.refresh()
+        elif time.monotonic() - self._checked_at >= self.poll_seconds:
+            with self._lock:
+                if self._reloading or time.monotonic() - self._checked_at < self.poll_seconds:
+                    return self._snapshot
+                self._checked_at = time.monotonic()
+                if self.db_manager.get_catalog_version() == self._snapshot.version:
+                    return self._snapshot
+                self._reloading = True
+            threading.Thread(target=self._reload, name="catalog-reload", daemon=True).start()
+        return self._snapshot
+
+    def refresh(self) -> CatalogSnapshot:
+        """Reload now, e.g. right after this process bulk-edited the catalog"""
+        with self._load_lock:
+            version, columns, rows = self.db_manager.load_catalog()
+            self._publish(CatalogSnapshot(rows, columns, version))
+            print(f"🔄 Loaded catalog snapshot v{version} ({len(rows)} products)")
+        return self._snapshot
+
+    def apply(self, product_id: int) -> CatalogSnapshot:
+        """Patch one product this process just added, edited or deleted into the snapshot;
+        reloads instead if other edits landed since the snapshot was taken"""
+        with self._load_lock:
+            version, columns, rows = self.db_manager.load_products([product_id])
+            snapshot = self._snapshot
+            if snapshot is None or columns != snapshot.columns or version != snapshot.version + 1:
+                if snapshot is None or version != snapshot.version:
+                    self.refresh()
+                return self._snapshot
+            self._publish(snapshot.with_product(product_id, rows[0] if rows else None, version))
+        return self._snapshot
+
+    def select(self, category: Optional[str] = None, max_price: Optional[float] = None,
+               tags: Optional[List[str]] = None) -> CatalogView:
+        return self.current().select(category, max_price, tags)
+
+    def _publish(self, snapshot: CatalogSnapshot):
+        """Build the search indexes off the request path, then swap the snapshot in"""
+        snapshot.tag_index()
+        snapshot.text_index()
+        with self._lock:
+            self._snapshot = snapshot
+            self._checked_at = time.monotonic()
+
+    def _reload(self):
+        try:
+            snapshot = self.refresh()
+            if self.on_reload is not None:
+                self.on_reload(snapshot)
+        except Exception as e:
+            print(f"⚠️ Catalog reload failed: {e}")
+        finally:
+            self._reloading = False
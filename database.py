@@ -1,19 +1,102 @@
 import sqlite3
+import copy
 import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Optional
+from operator import itemgetter
+from typing import List, Dict, Optional, Tuple
 import pandas as pd
 
+def split_tags(tags) -> List[str]:
+    """Normalized, de-duplicated tags from a comma-separated string or a list"""
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    return list(dict.fromkeys(tag.strip().lower() for tag in tags if tag and tag.strip()))
+
 class DatabaseManager:
-    def __init__(self, db_path: str = "recommendation_db.sqlite"):
+    def __init__(self, db_path: str = "recommendation_db.sqlite",
+                 busy_timeout_ms: Optional[int] = None,
+                 profile_cache_size: Optional[int] = None,
+                 profile_cache_ttl_seconds: Optional[float] = None):
         self.db_path = db_path
+        # Settings are read here, not in the signature, so a .env loaded after import applies
+        self.busy_timeout_ms = busy_timeout_ms if busy_timeout_ms is not None else int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+        
+        # Decoded user profiles, LRU; writes through this manager invalidate
+        # them, the TTL bounds staleness from writes by other workers
+        self.profile_cache_size = profile_cache_size if profile_cache_size is not None else int(os.getenv("PROFILE_CACHE_SIZE", 10000))
+        self.profile_cache_ttl = (profile_cache_ttl_seconds if profile_cache_ttl_seconds is not None
+                                  else float(os.getenv("PROFILE_CACHE_TTL_SECONDS", 60)))
+        self._profiles = OrderedDict()  # user_id -> (loaded_at, profile or None)
+        self._profiles_lock = threading.Lock()
+        self._profiles_generation = 0  # bumped on every invalidation
+        
+        # One long-lived connection per thread instead of connect/close per call
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        
         self.init_database()
     
+    def _connect(self) -> sqlite3.Connection:
+        """This thread's connection, opened and tuned on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=self.busy_timeout_ms / 1000,
+                check_same_thread=False,
+                cached_statements=256  # prepared statements are reused per connection
+            )
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")  # durable at checkpoints; safe with WAL
+            conn.execute("PRAGMA cache_size = -20000")  # ~20 MB page cache
+            conn.execute("PRAGMA mmap_size = 268435456")  # 256 MB memory-mapped reads
+            conn.execute("PRAGMA temp_store = MEMORY")
+            conn.execute("PRAGMA foreign_keys = ON")
+            conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
+    @contextmanager
+    def connection(self):
+        """Yield this thread's connection; commit on success, roll back on error"""
+        conn = self._connect()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    
+    def close(self):
+        """Close every pooled connection"""
+        with self._connections_lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._connections = []
+        self._local = threading.local()
+    
     def init_database(self):
         """Initialize the database with required tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        with self.connection() as conn:
+            self._create_tables(conn.cursor())
+            self._migrate(conn)
+        self.seed_sample_data()
+    
+    def _create_tables(self, cursor: sqlite3.Cursor):
+        """Create the products, user preferences and recommendation log tables"""
         # Products table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS products (
@@ -62,20 +145,105 @@ class DatabaseManager:
             )
         ''')
         
-        conn.commit()
-        conn.close()
-        self.seed_sample_data()
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_recommendations_log_timestamp ON recommendations_log(timestamp)")
+        
+        # One row per (tag, product) so tag filters are index lookups, not LIKE scans
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS product_tags (
+                tag TEXT NOT NULL,
+                product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+                PRIMARY KEY (tag, product_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_tags_product ON product_tags(product_id)")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_products_availability_category_price "
+            "ON products(availability, category, price)"
+        )
+        
+        # Catalog version, bumped on every product change so in-memory
+        # snapshots can tell when to reload
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS catalog_meta (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO catalog_meta (id, version) VALUES (1, 0)")
+        self._create_version_triggers(cursor)
+    
+    VERSION_EVENTS = ('INSERT', 'UPDATE', 'DELETE')
+    
+    def _create_version_triggers(self, cursor):
+        """Triggers bumping catalog_meta.version on every product change"""
+        for event in self.VERSION_EVENTS:
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS products_version_{event.lower()} AFTER {event} ON products
+                BEGIN
+                    UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+    
+    def _migrate(self, conn: sqlite3.Connection):
+        """Bring an existing database up to the current schema version"""
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        
+        if version < 1:
+            # Backfill product_tags from the comma-separated tags column
+            self._backfill_tags(conn)
+            conn.execute("PRAGMA user_version = 1")
+            print("✅ Migrated database to schema version 1 (product_tags)")
+        
+        if version < 2:
+            # Keep the most recently updated row per user, then make user_id unique
+            conn.execute('''
+                DELETE FROM user_preferences WHERE id NOT IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (
+                            PARTITION BY user_id ORDER BY updated_at DESC, id DESC
+                        ) AS position
+                        FROM user_preferences
+                    ) WHERE position = 1
+                )
+            ''')
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_user_preferences_user_id ON user_preferences(user_id)")
+            conn.execute("PRAGMA user_version = 2")
+            print("✅ Migrated database to schema version 2 (unique user_id)")
+        
+        if version < 3:
+            # Merchant SKU, the natural key bulk imports upsert on
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(products)")]
+            if 'sku' not in columns:
+                conn.execute("ALTER TABLE products ADD COLUMN sku TEXT")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_sku ON products(sku)")
+            conn.execute("PRAGMA user_version = 3")
+            print("✅ Migrated database to schema version 3 (products.sku)")
+    
+    def _backfill_tags(self, conn: sqlite3.Connection):
+        """Index the tags of every product that has none in product_tags yet"""
+        rows = conn.execute('''
+            SELECT id, tags FROM products
+            WHERE NOT EXISTS (SELECT 1 FROM product_tags WHERE product_id = products.id)
+        ''').fetchall()
+        conn.executemany(
+            "INSERT OR IGNORE INTO product_tags (tag, product_id) VALUES (?, ?)",
+            [(tag, product_id) for product_id, tags in rows for tag in split_tags(tags)]
+        )
+    
+    def _set_tags(self, conn: sqlite3.Connection, product_id: int, tags):
+        """Replace the indexed tags of one product"""
+        conn.execute("DELETE FROM product_tags WHERE product_id = ?", (product_id,))
+        conn.executemany(
+            "INSERT INTO product_tags (tag, product_id) VALUES (?, ?)",
+            [(tag, product_id) for tag in split_tags(tags)]
+        )
     
     def seed_sample_data(self):
         """Seed the database with comprehensive sample products"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Check if products already exist
-        cursor.execute("SELECT COUNT(*) FROM products")
-        if cursor.fetchone()[0] > 0:
-            conn.close()
-            return
+        with self.connection() as conn:
+            # Check if products already exist
+            if conn.execute("SELECT COUNT(*) FROM products").fetchone()[0] > 0:
+                return
         
         sample_products = [
             # FOOD PRODUCTS
@@ -263,23 +431,19 @@ class DatabaseManager:
              "https://example.com/sandals.jpg", True, 4.2),
         ]
         
-        cursor.executemany('''
-            INSERT INTO products (name, category, subcategory, price, brand, 
-                                description, tags, dietary_info, seasonal_relevance, 
-                                image_url, availability, rating)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', sample_products)
-        
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            conn.executemany('''
+                INSERT INTO products (name, category, subcategory, price, brand, 
+                                    description, tags, dietary_info, seasonal_relevance, 
+                                    image_url, availability, rating)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', sample_products)
+            self._backfill_tags(conn)
     
     def get_products(self, category: Optional[str] = None, 
                     max_price: Optional[float] = None,
                     tags: Optional[List[str]] = None) -> List[Dict]:
         """Retrieve products based on filters"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         query = "SELECT * FROM products WHERE availability = 1"
         params = []
         
@@ -291,82 +455,249 @@ class DatabaseManager:
             query += " AND price <= ?"
             params.append(max_price)
         
+        tags = split_tags(tags)
         if tags:
-            for tag in tags:
-                query += " AND tags LIKE ?"
-                params.append(f"%{tag}%")
+            # Products carrying every requested tag: intersection over the tag index
+            query += f''' AND id IN (
+                SELECT product_id FROM product_tags WHERE tag IN ({', '.join('?' for _ in tags)})
+                GROUP BY product_id HAVING COUNT(*) = ?
+            )'''
+            params.extend(tags)
+            params.append(len(tags))
         
-        cursor.execute(query, params)
-        columns = [description[0] for description in cursor.description]
-        products = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        # Catalog order, whichever index the planner picks (ranking ties keep this order)
+        query += " ORDER BY id"
+        
+        with self.connection() as conn:
+            cursor = conn.execute(query, params)
+            columns = [description[0] for description in cursor.description]
+            products = [dict(zip(columns, row)) for row in cursor.fetchall()]
         
-        conn.close()
         return products
     
+    def get_catalog_version(self) -> int:
+        """Current catalog version; changes whenever a product is added, edited or removed"""
+        with self.connection() as conn:
+            return conn.execute("SELECT version FROM catalog_meta WHERE id = 1").fetchone()[0]
+    
+    def load_catalog(self) -> Tuple[int, List[str], List[tuple]]:
+        """Version, column names and rows of the whole catalog (unavailable products included), read consistently"""
+        with self.connection() as conn:
+            conn.execute("BEGIN")
+            version = conn.execute("SELECT version FROM catalog_meta WHERE id = 1").fetchone()[0]
+            cursor = conn.execute("SELECT * FROM products ORDER BY id")
+            columns = [description[0] for description in cursor.description]
+            return version, columns, cursor.fetchall()
+    
+    def load_products(self, product_ids: List[int]) -> Tuple[int, List[str], List[tuple]]:
+        """Like load_catalog, for only the given products (missing ids are left out)"""
+        with self.connection() as conn:
+            conn.execute("BEGIN")
+            version = conn.execute("SELECT version FROM catalog_meta WHERE id = 1").fetchone()[0]
+            cursor = conn.execute(
+                f"SELECT * FROM products WHERE id IN ({', '.join('?' for _ in product_ids)}) ORDER BY id",
+                list(product_ids)
+            )
+            columns = [description[0] for description in cursor.description]
+            return version, columns, cursor.fetchall()
+    
+    PRODUCT_FIELDS = ('sku', 'name', 'category', 'subcategory', 'price', 'brand', 'description', 'tags',
+                      'dietary_info', 'seasonal_relevance', 'image_url', 'availability', 'rating')
+    
+    def _product_values(self, product: Dict) -> Dict:
+        """Column values for a product dict, with list tags joined the way they are stored"""
+        values = {field: product[field] for field in self.PRODUCT_FIELDS if field in product}
+        for field in ('tags', 'dietary_info', 'seasonal_relevance'):
+            if isinstance(values.get(field), list):
+                values[field] = ','.join(values[field])
+        return values
+    
+    def get_product(self, product_id: int) -> Optional[Dict]:
+        """Get a single product by id, regardless of availability"""
+        with self.connection() as conn:
+            cursor = conn.execute("SELECT * FROM products WHERE id = ?", (product_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            columns = [description[0] for description in cursor.description]
+            return dict(zip(columns, row))
+    
+    def add_product(self, product: Dict) -> int:
+        """Insert a product and return its id"""
+        values = self._product_values(product)
+        with self.connection() as conn:
+            cursor = conn.execute(
+                f"INSERT INTO products ({', '.join(values)}) VALUES ({', '.join('?' for _ in values)})",
+                list(values.values())
+            )
+            product_id = cursor.lastrowid
+            self._set_tags(conn, product_id, values.get('tags'))
+            return product_id
+    
+    def update_product(self, product_id: int, fields: Dict) -> Optional[Dict]:
+        """Update some fields of a product; returns the updated product or None if it does not exist"""
+        values = self._product_values(fields)
+        if values:
+            with self.connection() as conn:
+                cursor = conn.execute(
+                    f"UPDATE products SET {', '.join(f'{field} = ?' for field in values)} WHERE id = ?",
+                    list(values.values()) + [product_id]
+                )
+                if 'tags' in values and cursor.rowcount > 0:
+                    self._set_tags(conn, product_id, values['tags'])
+        
+        return self.get_product(product_id)
+    
+    def delete_product(self, product_id: int) -> bool:
+        """Delete a product; returns False if it did not exist"""
+        with self.connection() as conn:
+            # product_tags rows go with it (ON DELETE CASCADE)
+            cursor = conn.execute("DELETE FROM products WHERE id = ?", (product_id,))
+            return cursor.rowcount > 0
+    
+    # Secondary indexes dropped during bulk loads and rebuilt once at the end
+    # (product_tags' product_id index stays: re-imports delete tags by product)
+    DEFERRABLE_INDEXES = {
+        'idx_products_availability_category_price': "ON products(availability, category, price)",
+    }
+    
+    @contextmanager
+    def bulk_load(self):
+        """Drop the deferrable secondary indexes and per-row version triggers for the
+        duration of a bulk load; the catalog version is bumped once at the end"""
+        with self.connection() as conn:
+            for name in self.DEFERRABLE_INDEXES:
+                conn.execute(f"DROP INDEX IF EXISTS {name}")
+            for event in self.VERSION_EVENTS:
+                conn.execute(f"DROP TRIGGER IF EXISTS products_version_{event.lower()}")
+        try:
+            yield
+        finally:
+            with self.connection() as conn:
+                for name, definition in self.DEFERRABLE_INDEXES.items():
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS {name} {definition}")
+                self._create_version_triggers(conn)
+                conn.execute("UPDATE catalog_meta SET version = version + 1 WHERE id = 1")
+                conn.execute("ANALYZE")
+    
+    def upsert_products_by_sku(self, products: List[Dict]) -> List[int]:
+        """Insert or update a batch of complete products keyed on sku in one transaction; returns
+        their distinct ids (a sku repeated in the batch is written once, with its last values)"""
+        products = list({product['sku']: product for product in products}.values())
+        fields = list(self.PRODUCT_FIELDS)
+        rows = list(map(itemgetter(*fields), products))
+        
+        with self.connection() as conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS import_skus (sku TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM import_skus")
+            conn.executemany("INSERT INTO import_skus (sku) VALUES (?)", [(product['sku'],) for product in products])
+            
+            conn.executemany(f'''
+                INSERT INTO products ({', '.join(fields)}) VALUES ({', '.join('?' for _ in fields)})
+                ON CONFLICT (sku) DO UPDATE SET
+                    {', '.join(f'{field} = excluded.{field}' for field in fields if field != 'sku')}
+            ''', rows)
+            
+            ids = dict(conn.execute("SELECT sku, id FROM products JOIN import_skus USING (sku)").fetchall())
+            
+            # Indexed tags are replaced, not merged, for new and existing products alike
+            conn.executemany("DELETE FROM product_tags WHERE product_id = ?", [(product_id,) for product_id in ids.values()])
+            conn.executemany(
+                "INSERT OR IGNORE INTO product_tags (tag, product_id) VALUES (?, ?)",
+                [(tag, ids[product['sku']]) for product in products for tag in split_tags(product.get('tags'))]
+            )
+        
+        return [ids[product['sku']] for product in products]
+    
     def log_recommendation(self, user_query: str, user_preferences: Dict,
                           recommended_products: List[Dict], confidence_scores: List[float]):
         """Log recommendation for analytics"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO recommendations_log (user_query, user_preferences, 
-                                           recommended_products, confidence_scores)
-            VALUES (?, ?, ?, ?)
-        ''', (user_query, json.dumps(user_preferences), 
-              json.dumps(recommended_products), json.dumps(confidence_scores)))
-        
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            conn.execute('''
+                INSERT INTO recommendations_log (user_query, user_preferences, 
+                                               recommended_products, confidence_scores)
+                VALUES (?, ?, ?, ?)
+            ''', (user_query, json.dumps(user_preferences), 
+                  json.dumps(recommended_products), json.dumps(confidence_scores)))
+    
+    def log_recommendations(self, rows: List[Tuple[str, str, str, str, str]]):
+        """Log a batch of (timestamp, user_query, user_preferences, recommended_products,
+        confidence_scores) rows, already JSON-encoded, in one transaction"""
+        with self.connection() as conn:
+            conn.executemany('''
+                INSERT INTO recommendations_log (timestamp, user_query, user_preferences, 
+                                               recommended_products, confidence_scores)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+    
+    PROFILE_JSON_FIELDS = ('dietary_preferences', 'style_preferences', 'preferred_brands',
+                           'size_info', 'interaction_history')
+    
+    def cached_user_preferences(self, user_id: str) -> Tuple[bool, Optional[Dict]]:
+        """(hit, profile) from the profile cache alone, never touching SQLite"""
+        with self._profiles_lock:
+            cached = self._profiles.get(user_id)
+            if cached is None or time.monotonic() - cached[0] > self.profile_cache_ttl:
+                return False, None
+            self._profiles.move_to_end(user_id)
+            return True, copy.deepcopy(cached[1])
     
     def get_user_preferences(self, user_id: str) -> Optional[Dict]:
-        """Get user preferences by user_id"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Get user preferences by user_id, with the JSON columns decoded"""
+        now = time.monotonic()
+        with self._profiles_lock:
+            cached = self._profiles.get(user_id)
+            if cached is not None and now - cached[0] <= self.profile_cache_ttl:
+                self._profiles.move_to_end(user_id)
+                return copy.deepcopy(cached[1])
+            generation = self._profiles_generation
         
-        cursor.execute("SELECT * FROM user_preferences WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
+        with self.connection() as conn:
+            cursor = conn.execute("SELECT * FROM user_preferences WHERE user_id = ?", (user_id,))
+            result = cursor.fetchone()
+            profile = None
+            if result:
+                columns = [description[0] for description in cursor.description]
+                profile = self._decode_profile(dict(zip(columns, result)))
         
-        if result:
-            columns = [description[0] for description in cursor.description]
-            prefs = dict(zip(columns, result))
-            conn.close()
-            return prefs
-        
-        conn.close()
-        return None
+        # Unknown users are cached too, so anonymous traffic does not hit SQLite
+        with self._profiles_lock:
+            # An update that landed during the read may have been missed; don't cache it
+            if generation != self._profiles_generation:
+                return profile
+            self._profiles[user_id] = (now, profile)
+            self._profiles.move_to_end(user_id)
+            while len(self._profiles) > self.profile_cache_size:
+                self._profiles.popitem(last=False)
+        return copy.deepcopy(profile)
+    
+    def _decode_profile(self, row: Dict) -> Dict:
+        """Parse the JSON columns of a user_preferences row once"""
+        for field in self.PROFILE_JSON_FIELDS:
+            if isinstance(row.get(field), str):
+                try:
+                    row[field] = json.loads(row[field])
+                except ValueError:
+                    pass
+        return row
     
     def update_user_preferences(self, user_id: str, preferences: Dict):
         """Update or insert user preferences"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Check if user exists
-        existing = self.get_user_preferences(user_id)
-        
-        if existing:
-            cursor.execute('''
-                UPDATE user_preferences 
-                SET dietary_preferences = ?, style_preferences = ?, 
-                    budget_range = ?, preferred_brands = ?, size_info = ?,
-                    interaction_history = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (
-                json.dumps(preferences.get('dietary_preferences', [])),
-                json.dumps(preferences.get('style_preferences', [])),
-                preferences.get('budget_range', ''),
-                json.dumps(preferences.get('preferred_brands', [])),
-                json.dumps(preferences.get('size_info', {})),
-                json.dumps(preferences.get('interaction_history', [])),
-                user_id
-            ))
-        else:
-            cursor.execute('''
+        with self.connection() as conn:
+            conn.execute('''
                 INSERT INTO user_preferences (user_id, dietary_preferences, 
                                             style_preferences, budget_range, 
                                             preferred_brands, size_info, 
                                             interaction_history)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    dietary_preferences = excluded.dietary_preferences,
+                    style_preferences = excluded.style_preferences,
+                    budget_range = excluded.budget_range,
+                    preferred_brands = excluded.preferred_brands,
+                    size_info = excluded.size_info,
+                    interaction_history = excluded.interaction_history,
+                    updated_at = CURRENT_TIMESTAMP
             ''', (
                 user_id,
                 json.dumps(preferences.get('dietary_preferences', [])),
@@ -377,5 +708,7 @@ class DatabaseManager:
                 json.dumps(preferences.get('interaction_history', []))
             ))
         
-        conn.commit()
-        conn.close()
+        # Write-through invalidation: the next read reloads the new profile
+        with self._profiles_lock:
+            self._profiles.pop(user_id, None)
+            self._profiles_generation += 1
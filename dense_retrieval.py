@@ -0,0 +1,322 @@
+import argparse
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def product_text(product: Dict) -> str:
+    """Text a product is embedded from"""
+    tags = product.get('tags') or ''
+    if isinstance(tags, list):
+        tags = ', '.join(tags)
+    parts = (product.get('name'), product.get('brand'), product.get('category'), product.get('subcategory'),
+             tags, product.get('description'))
+    return '. '.join(str(part) for part in parts if part)
+
+
+class SentenceEncoder:
+    """A sentence-transformers model on CPU producing L2-normalised float32 vectors"""
+
+    def __init__(self, model_name: str = DEFAULT_MODEL, batch_size: int = 64):
+        from sentence_transformers import SentenceTransformer  # optional dependency, only for the dense backend
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.model.encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True,
+            convert_to_numpy=True, show_progress_bar=False
+        ), dtype=np.float32)
+
+
+class BatchingEncoder:
+    """Micro-batches concurrent single-query encodes into one vectorized encoder call.
+
+    Request threads queue their text through ``encode``; a worker thread
+    waits up to ``max_wait_ms`` after the first arrival for more, then
+    encodes up to ``max_batch`` distinct texts in one forward pass and hands
+    each caller its row.
+    """
+
+    def __init__(self, encoder, max_batch: Optional[int] = None, max_wait_ms: Optional[float] = None):
+        self.encoder = encoder
+        # Settings are read here, not in the signature, so a .env loaded after import applies
+        if max_batch is None:
+            max_batch = int(os.getenv("DENSE_MAX_BATCH", 32))
+        if max_wait_ms is None:
+            max_wait_ms = float(os.getenv("DENSE_BATCH_WAIT_MS", 2))
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+
+        self.requests = 0
+        self.batches = 0
+        self.encoded = 0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, text: str) -> Future:
+        """Queue a text; the future resolves to its vector"""
+        future = Future()
+        self._queue.put((text, future))
+        with self._lock:
+            self.requests += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="query-encoder", daemon=True)
+                self._thread.start()
+        return future
+
+    def encode(self, text: str) -> np.ndarray:
+        return self.submit(text).result()
+
+    def stats(self) -> Dict:
+        """Request/batch counters"""
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'encoded': self.encoded,
+            'average_batch': round(self.encoded / self.batches, 2) if self.batches else 0.0,
+        }
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            texts = []
+            try:
+                texts = list(dict.fromkeys(text for text, _ in batch))  # identical queries are encoded once
+                vectors = dict(zip(texts, self.encoder.encode(texts)))
+                for text, future in batch:
+                    future.set_result(vectors[text])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            self.batches += 1
+            self.encoded += len(texts)
+
+
+class DenseIndex:
+    """IVF (inverted file) index over memory-mapped, quantized product vectors.
+
+    ``build`` encodes products in batches, stores the vectors as float16 (or
+    int8 scaled by 127) and clusters them with spherical k-means into
+    ``nlist`` inverted lists. Vectors are written grouped by list, so a
+    query reads ``nprobe`` contiguous slices of the memory map instead of
+    the whole matrix; ``nprobe`` trades recall for latency.
+
+    On disk, ``<directory>/`` holds ``meta.json``, ``vectors.bin`` (the
+    memory-mapped matrix), ``ids.npy`` (product id per vector row),
+    ``centroids.npy`` and ``offsets.npy`` (start of each list).
+    """
+
+    DTYPES = {'float16': (np.float16, 1.0), 'int8': (np.int8, 1 / 127)}
+
+    def __init__(self, directory: str, nprobe: int = 16):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        dtype, self.scale = self.DTYPES[self.meta['dtype']]
+        self.vectors = np.memmap(os.path.join(directory, "vectors.bin"), dtype=dtype, mode='r',
+                                 shape=(self.meta['count'], self.meta['dimension']))
+        self.ids = np.load(os.path.join(directory, "ids.npy"))
+        self.centroids = np.load(os.path.join(directory, "centroids.npy"))
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"))
+        self.nprobe = max(1, min(nprobe, len(self.centroids)))
+
+        self._id_order = np.argsort(self.ids, kind='stable')
+        self._sorted_ids = self.ids[self._id_order]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, directory: str, products: Sequence[Dict], encoder, dtype: str = 'float16',
+              nlist: Optional[int] = None, batch_size: int = 256, train_size: int = 50000,
+              iterations: int = 10, seed: int = 0) -> "DenseIndex":
+        """Encode products and write a fresh index to directory (replacing any previous one)"""
+        storage_dtype, scale = cls.DTYPES[dtype]
+        n = len(products)
+        if n == 0:
+            raise ValueError("no products to index")
+        nlist = max(1, min(n, nlist or int(4 * np.sqrt(n))))
+
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=parent, prefix=".tmp-dense-")
+        try:
+            # 1. Encode in batches straight into an unordered memory map
+            started = time.time()
+            raw, dimension = None, None
+            for start in range(0, n, batch_size):
+                batch = encoder.encode([product_text(product) for product in products[start:start + batch_size]])
+                if raw is None:
+                    dimension = batch.shape[1]
+                    raw = np.memmap(os.path.join(tmp_path, "unordered.bin"), dtype=storage_dtype,
+                                    mode='w+', shape=(n, dimension))
+                raw[start:start + len(batch)] = cls._quantize(batch, storage_dtype)
+                if (start // batch_size) % 100 == 99:
+                    print(f"🔄 Encoded {start + len(batch)}/{n} products ({time.time() - started:.0f}s)")
+
+            # 2. Spherical k-means on a sample, then assign every vector to its nearest centroid
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(n, size=min(n, train_size), replace=False))
+            training = raw[sample].astype(np.float32) * scale
+            centroids = training[rng.choice(len(training), size=nlist, replace=False)]
+            for _ in range(iterations):
+                assignment = np.argmax(training @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, training)
+                filled = np.bincount(assignment, minlength=nlist) > 0
+                centroids[filled] = sums[filled]  # empty lists keep their old centroid
+                centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+            assignment = np.concatenate([
+                np.argmax((raw[start:start + 65536].astype(np.float32) * scale) @ centroids.T, axis=1)
+                for start in range(0, n, 65536)
+            ])
+
+            # 3. Rewrite the vectors grouped by list
+            order = np.argsort(assignment, kind='stable')
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))])
+            vectors = np.memmap(os.path.join(tmp_path, "vectors.bin"), dtype=storage_dtype,
+                                mode='w+', shape=(n, dimension))
+            for start in range(0, n, 65536):
+                vectors[start:start + 65536] = raw[order[start:start + 65536]]
+            vectors.flush()
+            del raw, vectors
+            os.remove(os.path.join(tmp_path, "unordered.bin"))
+
+            ids = np.array([product['id'] for product in products], dtype=np.int64)[order]
+            np.save(os.path.join(tmp_path, "ids.npy"), ids)
+            np.save(os.path.join(tmp_path, "centroids.npy"), centroids.astype(np.float32))
+            np.save(os.path.join(tmp_path, "offsets.npy"), offsets.astype(np.int64))
+            with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+                json.dump({
+                    'model': getattr(encoder, 'model_name', None),
+                    'dimension': int(dimension),
+                    'dtype': dtype,
+                    'count': n,
+                    'nlist': nlist,
+                    'built_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                }, f)
+
+            if os.path.isdir(directory):
+                shutil.rmtree(directory)
+            os.replace(tmp_path, directory)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        print(f"✅ Dense index: {n} products, {nlist} lists, {dtype} ({time.time() - started:.0f}s)")
+        return cls(directory)
+
+    @staticmethod
+    def _quantize(vectors: np.ndarray, dtype) -> np.ndarray:
+        if dtype == np.int8:
+            return np.clip(np.round(vectors * 127), -127, 127).astype(np.int8)
+        return vectors.astype(dtype)
+
+    def search(self, query: np.ndarray, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Product ids and cosine similarities of every vector in the nprobe lists nearest to query"""
+        query = np.asarray(query, dtype=np.float32)
+        nprobe = max(1, min(nprobe or self.nprobe, len(self.centroids)))
+        closeness = self.centroids @ query
+        lists = np.argpartition(-closeness, nprobe - 1)[:nprobe] if nprobe < len(closeness) else np.arange(len(closeness))
+
+        slices = [(self.offsets[i], self.offsets[i + 1]) for i in np.sort(lists) if self.offsets[i + 1] > self.offsets[i]]
+        if not slices:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        vectors = np.concatenate([self.vectors[start:end] for start, end in slices])
+        rows = np.concatenate([np.arange(start, end) for start, end in slices])
+        return self.ids[rows], (vectors.astype(np.float32) @ query) * self.scale
+
+    def similarity(self, product_ids: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Exact cosine similarity of the given products to query (0 for products not in the index)"""
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        positions = np.searchsorted(self._sorted_ids, product_ids)
+        positions = np.minimum(positions, max(0, len(self._sorted_ids) - 1))
+        found = (self._sorted_ids[positions] == product_ids) if len(self._sorted_ids) else np.zeros(len(product_ids), dtype=bool)
+
+        similarity = np.zeros(len(product_ids), dtype=np.float32)
+        if found.any():
+            vectors = self.vectors[self._id_order[positions[found]]].astype(np.float32)
+            similarity[found] = (vectors @ np.asarray(query, dtype=np.float32)) * self.scale
+        return similarity
+
+
+class DenseRetriever:
+    """Query encoder plus dense index, as used by the engine when RETRIEVAL_BACKEND=dense.
+
+    Query vectors come from ``cache`` (a ``QueryVectorCache``) when the
+    normalized query was seen before, else from the micro-batching encoder.
+    """
+
+    def __init__(self, index: DenseIndex, encoder, cache=None):
+        self.index = index
+        self.encoder = encoder
+        self.batcher = BatchingEncoder(encoder)
+        self.cache = cache
+        self.space = f"dense:{getattr(encoder, 'model_name', '')}"
+
+    @classmethod
+    def from_env(cls, cache=None) -> Optional["DenseRetriever"]:
+        """Load the index in DENSE_INDEX_DIR and its model; None (with a warning) if either is unavailable"""
+        directory = os.getenv("DENSE_INDEX_DIR", "dense_index")
+        try:
+            index = DenseIndex(directory, nprobe=int(os.getenv("DENSE_NPROBE", 16)))
+            encoder = SentenceEncoder(os.getenv("DENSE_MODEL") or index.meta.get('model') or DEFAULT_MODEL)
+        except ImportError:
+            print("⚠️ RETRIEVAL_BACKEND=dense needs sentence-transformers; falling back to BM25")
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ No usable dense index in {directory} ({e}); run `python dense_retrieval.py` to build it. Falling back to BM25")
+            return None
+        print(f"✅ Dense retrieval: {len(index)} products, {len(index.centroids)} lists, nprobe {index.nprobe}")
+        return cls(index, encoder, cache)
+
+    def encode_query(self, query: str) -> np.ndarray:
+        if self.cache is None:
+            return self.batcher.encode(query)
+        return self.cache.get_or_compute(self.space, query, self.batcher.encode)
+
+
+def main():
+    from database import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Encode the product catalog into a dense IVF index (CPU)")
+    parser.add_argument("--db", default="recommendation_db.sqlite", help="SQLite database to read products from")
+    parser.add_argument("--out", default=os.getenv("DENSE_INDEX_DIR", "dense_index"), help="index directory")
+    parser.add_argument("--model", default=os.getenv("DENSE_MODEL") or DEFAULT_MODEL, help="sentence-transformers model")
+    parser.add_argument("--dtype", choices=tuple(DenseIndex.DTYPES), default="float16", help="vector storage type")
+    parser.add_argument("--nlist", type=int, help="number of inverted lists (default 4 * sqrt(products))")
+    parser.add_argument("--batch-size", type=int, default=256, help="products encoded per batch")
+    args = parser.parse_args()
+
+    _, columns, rows = DatabaseManager(args.db).load_catalog()
+    products = [dict(zip(columns, row)) for row in rows]
+    DenseIndex.build(args.out, products, SentenceEncoder(args.model), dtype=args.dtype,
+                     nlist=args.nlist, batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
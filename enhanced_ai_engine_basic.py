@@ -1,21 +1,134 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS, TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
 import numpy as np
+import asyncio
 import json
-import pickle
+import threading
 import os
-from typing import Dict, List, Optional, Tuple
-from groq import Groq
+from typing import AsyncIterator, Dict, FrozenSet, List, Optional, Set, Tuple
+from groq import Groq, AsyncGroq
 import re
 from dotenv import load_dotenv
 
+from catalog_snapshot import CatalogSnapshot, CatalogView
+from database import split_tags
+from dense_retrieval import DenseRetriever
+from index_store import IndexStore, catalog_hash
+from llm_cache import PreferenceCache, QueryVectorCache, ResponseCache
+from text_matching import KeywordMatcher
+
 load_dotenv()
 
+class RecommendationBatch:
+    """Scores for a candidate set, with reasoning strings built on demand"""
+
+    def __init__(self, engine: "EnhancedAIEngine", products: CatalogView, context: Dict,
+                 scores: np.ndarray, text_similarity: Optional[np.ndarray]):
+        self.engine = engine
+        self.products = products
+        self.context = context
+        self.scores = scores
+        self.text_similarity = text_similarity
+        self._products = {}
+        self._reasoning = {}
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    @property
+    def confidence(self) -> np.ndarray:
+        """Scores as the integer percentages shown to users"""
+        return np.round(self.scores * 100).astype(np.int64)
+
+    def top_k(self, k: int) -> np.ndarray:
+        """Indices of the k best products, highest confidence first, ties in candidate order"""
+        # Same result as a stable descending sort, but O(n): argpartition
+        # selects, and only the k survivors are sorted
+        confidence = self.confidence
+        n = len(confidence)
+        if k <= 0 or n == 0:
+            return np.array([], dtype=np.int64)
+
+        if k >= n:
+            candidates = np.arange(n)
+        else:
+            # Everything above the k-th largest value is in; ties on the
+            # boundary are resolved by position, like a stable sort would
+            threshold = confidence[np.argpartition(-confidence, k - 1)[k - 1]]
+            above = np.flatnonzero(confidence > threshold)
+            at_threshold = np.flatnonzero(confidence == threshold)[:k - len(above)]
+            candidates = np.concatenate([above, at_threshold])
+
+        order = np.lexsort((candidates, -confidence[candidates]))
+        return candidates[order]
+
+    def product(self, i: int) -> Dict:
+        """Product dict of the i-th candidate, built on first access"""
+        if i not in self._products:
+            self._products[i] = self.products[i]
+        return self._products[i]
+
+    def reasoning(self, i: int) -> str:
+        """Explain the score of the i-th product in the batch"""
+        if i not in self._reasoning:
+            self._reasoning[i] = self._build_reasoning(i)
+        return self._reasoning[i]
+
+    def _build_reasoning(self, i: int) -> str:
+        product = self.product(i)
+        context = self.context
+        snapshot, row = self.products.snapshot, self.products.rows[i]
+        name_lower, tag_terms = snapshot.names_lower[row], snapshot.tag_terms[row]
+        reasoning_parts = []
+
+        if context['category'] == product['category']:
+            reasoning_parts.append(f"Perfect category match ({product['category']})")
+        elif context['category'] == 'both':
+            reasoning_parts.append(f"Category compatible ({product['category']})")
+
+        for _, reason in (self.engine._keyword_match(name_lower, tag_terms, context),
+                          self.engine._subcategory_match(product.get('subcategory'), context)):
+            if reason:
+                reasoning_parts.append(reason)
+
+        budget_max = context['budget_max']
+        if budget_max > 0:
+            if product['price'] <= budget_max:
+                reasoning_parts.append(f"Within budget (₹{product['price']} ≤ ₹{budget_max})")
+            else:
+                reasoning_parts.append(f"Over budget (₹{product['price']} > ₹{budget_max})")
+        else:
+            reasoning_parts.append("No budget constraint")
+
+        _, tag_reason = self.engine._tag_match(tag_terms, context)
+        if tag_reason:
+            reasoning_parts.append(tag_reason)
+
+        if context['brand_prefs']:
+            if product['brand'] in context['brand_prefs']:
+                reasoning_parts.append(f"Preferred brand ({product['brand']})")
+            else:
+                reasoning_parts.append(f"Different brand ({product['brand']})")
+
+        reasoning_parts.append(f"Quality rating: {product.get('rating', 3)}/5")
+
+        if self.text_similarity is not None and self.text_similarity[i] > 0.3:
+            reasoning_parts.append(f"High text similarity ({self.text_similarity[i]:.2f})")
+
+        return " • ".join(reasoning_parts)
+
+
 class EnhancedAIEngine:
     def __init__(self):
         self.client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+        self.async_client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
         self.model = "llama3-70b-8192"  # Using Llama 3 70B for better reasoning
         
+        # Async LLM calls: per-call timeout and a per-worker concurrency cap
+        self.llm_timeout = float(os.getenv("LLM_TIMEOUT_SECONDS", 30))
+        self.llm_semaphore = asyncio.Semaphore(int(os.getenv("LLM_MAX_CONCURRENCY", 16)))
+        
         # Initialize TF-IDF vectorizer for basic text similarity
         print("Initializing TF-IDF vectorizer...")
         self.vectorizer = TfidfVectorizer(
@@ -24,11 +137,35 @@ class EnhancedAIEngine:
             ngram_range=(1, 2)
         )
         
-        # Cache for embeddings
-        self.embeddings_cache = {}
-        self.embeddings_file = "embeddings_cache.pkl"
+        # Persisted TF-IDF vocabulary and product matrix, keyed by catalog hash
+        index_dir = os.getenv("TFIDF_INDEX_DIR", "index_cache")
+        self.index_store = IndexStore(index_dir) if index_dir else None
         self.product_vectors = None
         self.product_descriptions = []
+        self.product_index = {}  # product id -> row in product_vectors
+        self._index_generation = 0  # bumped whenever product_index changes
+        self._description_row_cache = (None, -1, None)
+        
+        # Incremental updates append rows against the fitted vocabulary; a
+        # background refit runs once drift passes the threshold
+        self._index_lock = threading.RLock()
+        self.refit_drift_threshold = float(os.getenv("INDEX_REFIT_DRIFT", 0.2))
+        self._refit_thread = None
+        self._reset_drift(0)
+        
+        # Query vectors (TF-IDF terms, dense embeddings) by normalized query;
+        # TF-IDF entries are keyed by vocabulary version and dropped on refit
+        self.query_vector_cache = QueryVectorCache(int(os.getenv("QUERY_VECTOR_CACHE_SIZE", 4096)))
+        self._vocabulary_version = 0
+        
+        # Two-stage retrieval: larger candidate sets are cut down to this many
+        # products by BM25 before the full heuristic scorer runs
+        self.candidate_limit = max(1, int(os.getenv("RETRIEVAL_CANDIDATES", 300)))
+        
+        # RETRIEVAL_BACKEND=dense adds sentence-embedding retrieval (an offline
+        # built IVF index, see dense_retrieval.py) beside the BM25/TF-IDF path
+        self.retrieval_backend = os.getenv("RETRIEVAL_BACKEND", "bm25").lower()
+        self.dense = DenseRetriever.from_env(self.query_vector_cache) if self.retrieval_backend == "dense" else None
         
         # Product categories and their embeddings
         self.categories = {
@@ -48,24 +185,209 @@ class EnhancedAIEngine:
             }
         }
         
+        # Flattened (category, subcategory, keyword) list in declaration order,
+        # with a multi-pattern matcher and a keyword TF-IDF matrix built once
+        self.category_keywords = [
+            (category, subcategory, keyword)
+            for category, subcategories in self.categories.items()
+            for subcategory, keywords in subcategories.items()
+            for keyword in keywords
+        ]
+        self.keyword_matcher = KeywordMatcher([keyword for _, _, keyword in self.category_keywords])
+        self.keyword_vectors = None
+        self._analyzer = self.vectorizer.build_analyzer()
+        
+        # Cache of LLM preference extractions (exact + near-duplicate queries)
+        self.preference_cache = PreferenceCache(
+            self._cache_query_terms,
+            max_entries=int(os.getenv("PREFERENCE_CACHE_SIZE", 1024)),
+            ttl_seconds=float(os.getenv("PREFERENCE_CACHE_TTL_SECONDS", 24 * 3600)),
+            similarity_threshold=float(os.getenv("PREFERENCE_CACHE_SIMILARITY", 0.92)),
+            db_path=os.getenv("PREFERENCE_CACHE_DB", "llm_cache.sqlite") or None,
+            unknown_words=self._unknown_query_words
+        )
+        
+        # Cache of generated Mitra responses keyed by preferences + top-k ids
+        self.response_cache = ResponseCache(
+            max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", 512)),
+            max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 8 * 1024 * 1024)),
+            ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 3600))
+        )
+        
         print("Enhanced AI Engine initialized successfully!")
     
+    def _product_description(self, product: Dict) -> str:
+        """Text indexed by TF-IDF for a product"""
+        return f"{product['name']} {product['brand']} {product['category']} {' '.join(split_tags(product.get('tags')))}"
+    
     def generate_product_embeddings(self, products: List[Dict]):
         """Generate TF-IDF vectors for all products"""
         print(f"Generating TF-IDF vectors for {len(products)} products...")
         
         # Create product descriptions
-        self.product_descriptions = []
-        for product in products:
-            desc = f"{product['name']} {product['brand']} {product['category']} {' '.join(product.get('tags', []))}"
-            self.product_descriptions.append(desc)
-        
-        # Fit vectorizer and transform descriptions
-        if self.product_descriptions:
-            self.product_vectors = self.vectorizer.fit_transform(self.product_descriptions)
-            print(f"✅ Generated TF-IDF vectors for {len(products)} products")
-        else:
+        descriptions = [self._product_description(product) for product in products]
+        product_ids = [product.get('id') for product in products]
+        
+        if not descriptions:
             print("⚠️ No products to vectorize")
+            return
+        
+        # Reuse the persisted index when the catalog has not changed
+        key = catalog_hash(descriptions, product_ids, self.vectorizer)
+        with self._index_lock:
+            stored = self.index_store.load(key, self.vectorizer) if self.index_store else None
+            
+            if stored is not None:
+                self.product_vectors = stored['matrix']
+                print(f"✅ Loaded TF-IDF index for {len(products)} products ({key[:8]})")
+            else:
+                # Fit vectorizer and transform descriptions
+                self.product_vectors = self.vectorizer.fit_transform(descriptions)
+                if self.index_store:
+                    self.index_store.save(key, self.vectorizer, self.product_vectors, product_ids)
+                print(f"✅ Generated TF-IDF vectors for {len(products)} products")
+            
+            self._analyzer = self.vectorizer.build_analyzer()
+            self.product_descriptions = descriptions
+            self.product_index = {product_id: row for row, product_id in enumerate(product_ids)}
+            self._reset_drift(len(product_ids))
+            self._vocabulary_changed()
+        
+        self.preference_cache.reindex()
+    
+    # Incremental index maintenance
+    
+    def upsert_products(self, products: List[Dict]) -> int:
+        """Add or update products by id against the fitted vocabulary; returns the rows written"""
+        if self.product_vectors is None:
+            self.generate_product_embeddings(products)
+            return len(products)
+        
+        with self._index_lock:
+            # Unchanged text (price or stock edits) is skipped; changed or new
+            # products get a fresh row appended and their id repointed at it
+            changed = {}
+            for product in products:
+                description = self._product_description(product)
+                row = self.product_index.get(product['id'])
+                if row is None or self.product_descriptions[row] != description:
+                    changed[product['id']] = description
+            
+            if changed:
+                descriptions = list(changed.values())
+                start = self.product_vectors.shape[0]
+                self.product_vectors = sparse.vstack(
+                    [self.product_vectors, self.vectorizer.transform(descriptions)], format='csr'
+                )
+                for offset, (product_id, description) in enumerate(changed.items()):
+                    self.product_index[product_id] = start + offset
+                    self.product_descriptions.append(description)
+                self._index_changes += len(changed)
+                self._index_generation += 1
+                self._track_vocabulary_drift(descriptions)
+        
+        self._maybe_schedule_refit()  # once drift passes refit_drift_threshold
+        return len(changed)
+    
+    def remove_products(self, product_ids: List) -> int:
+        """Drop products from the index by id; returns how many were indexed"""
+        with self._index_lock:
+            removed = sum(1 for product_id in product_ids if self.product_index.pop(product_id, None) is not None)
+            self._index_changes += removed
+            self._index_generation += 1
+        
+        self._maybe_schedule_refit()
+        return removed
+    
+    def unindexed_products(self, product_ids: List) -> List:
+        """The ids among product_ids that have no row in the index"""
+        with self._index_lock:
+            return [product_id for product_id in product_ids if product_id not in self.product_index]
+    
+    def index_drift(self) -> float:
+        """How far the index has moved from its last full fit (0 = freshly fitted)"""
+        with self._index_lock:
+            row_drift = self._index_changes / max(1, self._rows_at_fit)
+            # Unseen terms relative to the size of the fitted corpus
+            vocabulary_drift = self._oov_tokens / max(1, self._terms_at_fit)
+            return max(row_drift, vocabulary_drift)
+    
+    def index_stats(self) -> Dict:
+        """Size and drift of the TF-IDF index"""
+        with self._index_lock:
+            return {
+                'products': len(self.product_index),
+                'rows': self.product_vectors.shape[0] if self.product_vectors is not None else 0,
+                'vocabulary': len(getattr(self.vectorizer, 'vocabulary_', {})),
+                'changes_since_fit': self._index_changes,
+                'drift': round(self.index_drift(), 4),
+                'refit_running': bool(self._refit_thread and self._refit_thread.is_alive()),
+            }
+    
+    def _reset_drift(self, rows: int):
+        self._index_generation += 1
+        self._rows_at_fit = rows
+        self._terms_at_fit = self.product_vectors.nnz if self.product_vectors is not None else 0
+        self._index_changes = 0
+        self._oov_tokens = 0
+    
+    def _track_vocabulary_drift(self, descriptions: List[str]):
+        """Count tokens of newly indexed text that the fitted vocabulary cannot represent"""
+        vocabulary = self.vectorizer.vocabulary_
+        for description in descriptions:
+            self._oov_tokens += sum(1 for token in self._analyzer(description) if token not in vocabulary)
+    
+    def _maybe_schedule_refit(self):
+        if self.index_drift() < self.refit_drift_threshold:
+            return
+        with self._index_lock:
+            if self._refit_thread is not None and self._refit_thread.is_alive():
+                return
+            self._refit_thread = threading.Thread(target=self._refit_index, name="tfidf-refit", daemon=True)
+            self._refit_thread.start()
+    
+    def _refit_index(self):
+        """Refit vocabulary and matrix from the live products, then swap them in"""
+        try:
+            with self._index_lock:
+                snapshot = {product_id: self.product_descriptions[row] for product_id, row in self.product_index.items()}
+            
+            product_ids = sorted(snapshot)  # id order, as the startup fit reads products
+            descriptions = [snapshot[product_id] for product_id in product_ids]
+            if not descriptions:
+                return
+            print(f"🔄 Refitting TF-IDF index for {len(descriptions)} products (drift {self.index_drift():.2f})...")
+            vectorizer = TfidfVectorizer(**self.vectorizer.get_params())
+            matrix = vectorizer.fit_transform(descriptions)
+            
+            with self._index_lock:
+                # Fold in edits that landed while the refit was running
+                live = {product_id: self.product_descriptions[row] for product_id, row in self.product_index.items()}
+                index = {product_id: row for row, product_id in enumerate(product_ids) if product_id in live}
+                pending = {product_id: description for product_id, description in live.items()
+                           if snapshot.get(product_id) != description}
+                if pending:
+                    start = matrix.shape[0]
+                    matrix = sparse.vstack([matrix, vectorizer.transform(list(pending.values()))], format='csr')
+                    for offset, (product_id, description) in enumerate(pending.items()):
+                        index[product_id] = start + offset
+                        descriptions.append(description)
+                
+                self.vectorizer = vectorizer
+                self._analyzer = vectorizer.build_analyzer()
+                self.product_vectors = matrix
+                self.product_index = index
+                self.product_descriptions = descriptions
+                self._reset_drift(len(index))
+                self._vocabulary_changed()
+            
+            self.preference_cache.reindex()
+            if self.index_store and not pending and len(index) == len(product_ids):
+                key = catalog_hash(descriptions, product_ids, vectorizer)
+                self.index_store.save(key, vectorizer, matrix, product_ids)
+            print(f"✅ TF-IDF index refitted ({len(index)} products)")
+        except Exception as e:
+            print(f"⚠️ Background TF-IDF refit failed: {e}")
     
     def get_text_similarity(self, text1: str, text2: str) -> float:
         """Calculate similarity between two texts using TF-IDF"""
@@ -76,46 +398,235 @@ class EnhancedAIEngine:
         except:
             return 0.0
     
-    def extract_user_preferences_enhanced(self, user_query: str) -> Dict:
-        """Enhanced preference extraction using category matching and LLM"""
-        
-        # Find similar categories using basic text matching
+    def _vocabulary_changed(self):
+        """Rebuild what depends on the fitted vocabulary; call with _index_lock held"""
+        self._vocabulary_version += 1
+        self.query_vector_cache.clear(f"tfidf:{self._vocabulary_version - 1}")
+        self._build_keyword_vectors()
+    
+    def _build_keyword_vectors(self):
+        """Precompute TF-IDF vectors of all category keywords against the fitted vocabulary.
+
+        The matrix is only ~55 rows, so it is kept dense: scoring a query is
+        then a column gather and one small matrix-vector product.
+        """
+        keywords = [keyword for _, _, keyword in self.category_keywords]
+        self.keyword_vectors = self.vectorizer.transform(keywords).toarray()
+    
+    def _query_terms(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Vocabulary columns and L2-normalised TF-IDF weights of a single query,
+        computed from the normalized query and cached in query_vector_cache"""
+        with self._index_lock:
+            vocabulary = self.vectorizer.vocabulary_
+            idf = self.vectorizer.idf_
+            analyzer = self._analyzer
+            space = f"tfidf:{self._vocabulary_version}"
+        
+        def compute(normalized: str) -> Tuple[np.ndarray, np.ndarray]:
+            counts = {}
+            for token in analyzer(normalized):
+                column = vocabulary.get(token)
+                if column is not None:
+                    counts[column] = counts.get(column, 0) + 1
+            
+            columns = np.fromiter(sorted(counts), dtype=np.int32, count=len(counts))
+            values = np.array([counts[column] for column in columns], dtype=np.float64) * idf[columns]
+            norm = np.sqrt(np.dot(values, values))
+            if norm > 0:
+                values /= norm
+            return columns, values
+        
+        return self.query_vector_cache.get_or_compute(space, query, compute)
+    
+    def _cache_query_terms(self, query: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Query TF-IDF terms for near-duplicate cache lookups, None before the vocabulary is fitted"""
+        if not hasattr(self.vectorizer, 'vocabulary_'):
+            return None
+        return self._query_terms(query)
+    
+    def _unknown_query_words(self, query: str) -> FrozenSet[str]:
+        """Words of a query outside the TF-IDF vocabulary (stop words and filler aside); near-duplicate
+        cache hits must share them exactly, since the query vectors cannot see them"""
+        with self._index_lock:
+            vocabulary = getattr(self.vectorizer, 'vocabulary_', {})
+            analyzer = self._analyzer
+        return frozenset(token for token in analyzer(query)
+                         if ' ' not in token  # unigrams; the analyzer also yields bigrams
+                         and token not in vocabulary and token not in self.QUERY_FILLER_WORDS)
+    
+    def transform_query(self, query: str) -> sparse.csr_matrix:
+        """TF-IDF vector of a single query against the fitted vocabulary.
+
+        Equivalent to ``vectorizer.transform([query])`` without the per-call
+        validation overhead, which dominates for one short string.
+        """
+        with self._index_lock:
+            columns, values = self._query_terms(query)
+            return sparse.csr_matrix(
+                (values, columns, np.array([0, len(columns)], dtype=np.int32)),
+                shape=(1, len(self.vectorizer.idf_))
+            )
+    
+    def _keyword_similarities(self, query: str) -> np.ndarray:
+        """Cosine similarity between the query and every category keyword"""
+        with self._index_lock:
+            if self.keyword_vectors is None:
+                return np.zeros(len(self.category_keywords))
+            columns, values = self._query_terms(query)
+            # Both sides are L2-normalised TF-IDF vectors, so the dot product is the cosine
+            return self.keyword_vectors[:, columns] @ values
+    
+    def match_categories(self, user_query: str) -> Dict:
+        """Score food/fashion categories by exact keyword hits and TF-IDF similarity"""
         query_lower = user_query.lower()
-        category_scores = {}
+        exact_hits = self.keyword_matcher.matches(query_lower)
+        similarities = self._keyword_similarities(query_lower)
         
-        for category, subcategories in self.categories.items():
-            max_score = 0
-            best_matches = []
-            
-            for subcategory, keywords in subcategories.items():
-                for keyword in keywords:
-                    if keyword in query_lower:
-                        score = 1.0
-                        best_matches.append((keyword, score, subcategory))
-                        max_score = max(max_score, score)
-                    else:
-                        # Basic similarity check
-                        score = self.get_text_similarity(query_lower, keyword)
-                        if score > 0.3:
-                            best_matches.append((keyword, score, subcategory))
-                            max_score = max(max_score, score)
-            
+        category_scores = {}
+        matches_by_category = {}
+        for keyword_id, (category, subcategory, keyword) in enumerate(self.category_keywords):
+            matches = matches_by_category.setdefault(category, [])
+            if keyword_id in exact_hits:
+                matches.append((keyword, 1.0, subcategory))
+            elif similarities[keyword_id] > 0.3:
+                matches.append((keyword, float(similarities[keyword_id]), subcategory))
+        
+        for category, best_matches in matches_by_category.items():
             if best_matches:
                 category_scores[category] = {
-                    'score': max_score,
+                    'score': max(match[1] for match in best_matches),
                     'matches': sorted(best_matches, key=lambda x: x[1], reverse=True)[:5]
                 }
         
-        # Use LLM for structured extraction
-        llm_preferences = self.extract_with_llm(user_query)
+        return category_scores
+    
+    def extract_user_preferences_enhanced(self, user_query: str, profile: Optional[Dict] = None) -> Dict:
+        """Enhanced preference extraction using category matching and LLM, personalized by the stored profile"""
+        
+        # Find similar categories using keyword matching
+        category_scores = self.match_categories(user_query)
+        profile_prefs = self.profile_preferences(profile)
+        
+        # Use LLM for structured extraction, unless keyword matching and the profile already cover the query
+        if self._profile_covers_query(user_query, category_scores, profile_prefs):
+            llm_preferences = self._local_extraction(user_query)
+        else:
+            llm_preferences = self.extract_with_llm(user_query)
         
         # Combine basic matching and LLM results
         enhanced_preferences = self.combine_preferences(llm_preferences, category_scores, user_query)
         
-        return enhanced_preferences
+        return self.merge_profile(enhanced_preferences, profile_prefs)
     
-    def extract_with_llm(self, user_query: str) -> Dict:
-        """Extract preferences using LLM"""
+    async def extract_user_preferences_enhanced_async(self, user_query: str, profile: Optional[Dict] = None) -> Dict:
+        """Async variant of extract_user_preferences_enhanced; the LLM call does not block the event loop"""
+        category_scores = self.match_categories(user_query)
+        profile_prefs = self.profile_preferences(profile)
+        if self._profile_covers_query(user_query, category_scores, profile_prefs):
+            llm_preferences = self._local_extraction(user_query)
+        else:
+            llm_preferences = await self.extract_with_llm_async(user_query)
+        preferences = self.combine_preferences(llm_preferences, category_scores, user_query)
+        return self.merge_profile(preferences, profile_prefs)
+    
+    PROFILE_FIELDS = (
+        ('dietary_preferences', 'dietary_preferences'),
+        ('style_preferences', 'style_preferences'),
+        ('preferred_brands', 'brand_preferences'),
+    )
+    
+    # Words that carry no constraint of their own in a shopping query
+    QUERY_FILLER_WORDS = ENGLISH_STOP_WORDS | {
+        'show', 'want', 'need', 'looking', 'buy', 'get', 'something', 'recommend', 'suggest',
+        'good', 'best', 'nice', 'items', 'products', 'options', 'stuff', 'please',
+    }
+    
+    def profile_preferences(self, profile: Optional[Dict]) -> Dict:
+        """Preference fields implied by a stored user profile (see DatabaseManager.get_user_preferences)"""
+        if not profile:
+            return {}
+        
+        preferences = {}
+        for profile_field, field in self.PROFILE_FIELDS:
+            values = profile.get(profile_field)
+            if isinstance(values, list) and values:
+                # Brands stay as stored: brand matching compares catalog values exactly
+                preferences[field] = [str(value) if field == 'brand_preferences' else str(value).lower()
+                                      for value in values]
+        
+        # budget_range is stored as "min-max" (or a single amount)
+        amounts = [int(amount) for amount in re.findall(r'\d+', str(profile.get('budget_range') or ''))]
+        if amounts and amounts[-1] > 0:
+            preferences['budget_min'] = amounts[0] if len(amounts) > 1 else 0
+            preferences['budget_max'] = amounts[-1]
+        
+        return preferences
+    
+    def merge_profile(self, preferences: Dict, profile_prefs: Dict) -> Dict:
+        """Fill in preferences the query did not state from the profile; the query wins on conflicts"""
+        if not profile_prefs:
+            return preferences
+        
+        merged = dict(preferences)
+        applied = []
+        for _, field in self.PROFILE_FIELDS:
+            values = list(merged.get(field) or [])
+            known = {str(value).lower() for value in values}
+            additions = [value for value in profile_prefs.get(field, []) if value.lower() not in known]
+            if additions:
+                merged[field] = values + additions
+                applied.append(field)
+        
+        if profile_prefs.get('budget_max') and not merged.get('budget_max', 0) > 0:
+            merged['budget_min'] = profile_prefs['budget_min']
+            merged['budget_max'] = profile_prefs['budget_max']
+            applied.append('budget')
+        
+        merged['profile_applied'] = applied
+        return merged
+    
+    def _local_extraction(self, user_query: str) -> Dict:
+        """Rule-based extraction used in place of the LLM, plus a subcategory named in the query"""
+        preferences = self._fallback_extraction(user_query)
+        words = set(re.findall(r"[a-z][a-z-]*", user_query.lower()))
+        for category, subcategories in self.categories.items():
+            for subcategory in subcategories:
+                if subcategory in words:
+                    preferences['category'], preferences['subcategory'] = category, subcategory
+                    return preferences
+        return preferences
+    
+    def _profile_covers_query(self, user_query: str, category_scores: Dict, profile_prefs: Dict) -> bool:
+        """Whether keyword matching plus the profile capture everything the LLM would extract.
+
+        True when the category is clear from keyword hits, the query states no
+        amounts (budgets need the LLM), and every other word is a matched
+        keyword, something the profile already says, or filler.
+        """
+        if not profile_prefs or not category_scores:
+            return False
+        if max(data['score'] for data in category_scores.values()) <= 0.5:
+            return False
+        
+        query_lower = user_query.lower()
+        if re.search(r'\d', query_lower):
+            return False
+        
+        known = set(self.categories)
+        known.update(subcategory for subcategories in self.categories.values() for subcategory in subcategories)
+        for data in category_scores.values():
+            for keyword, _, subcategory in data['matches']:
+                known.update(keyword.split())
+                known.add(subcategory)
+        for _, field in self.PROFILE_FIELDS:
+            for value in profile_prefs.get(field, []):
+                known.update(value.split())
+        
+        words = re.findall(r"[a-z][a-z-]*", query_lower)
+        return all(word in known or word in self.QUERY_FILLER_WORDS for word in words)
+    
+    def _extraction_messages(self, user_query: str) -> List[Dict]:
+        """Chat messages asking the LLM for structured preferences"""
         prompt = f"""
         Analyze this Indian shopping query and extract structured preferences in JSON format.
         
@@ -158,29 +669,81 @@ class EnhancedAIEngine:
         }}
         """
         
+        return [
+            {"role": "system", "content": "You are an expert at extracting detailed shopping preferences from Indian consumer queries. Always return valid JSON with comprehensive details."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _parse_extraction(self, content: str) -> Optional[Dict]:
+        """Parse the JSON object out of an extraction completion, None if there is none"""
+        json_match = re.search(r'\{.*\}', content.strip(), re.DOTALL)
+        
+        if json_match:
+            return json.loads(json_match.group())
+        return None
+    
+    def extract_with_llm(self, user_query: str) -> Dict:
+        """Extract preferences using LLM, answering repeated queries from the preference cache"""
+        cached = self.preference_cache.get(user_query)
+        if cached is not None:
+            return cached
+        
         try:
             response = self.client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": "You are an expert at extracting detailed shopping preferences from Indian consumer queries. Always return valid JSON with comprehensive details."},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=self._extraction_messages(user_query),
                 model=self.model,
                 temperature=0.1,
                 max_tokens=800
             )
             
-            content = response.choices[0].message.content.strip()
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            
-            if json_match:
-                return json.loads(json_match.group())
-            else:
+            preferences = self._parse_extraction(response.choices[0].message.content)
+            if preferences is None:
                 return self._fallback_extraction(user_query)
+            
+            self.preference_cache.set(user_query, preferences)
+            return preferences
                 
         except Exception as e:
             print(f"Error in LLM extraction: {e}")
             return self._fallback_extraction(user_query)
     
+    async def extract_with_llm_async(self, user_query: str) -> Dict:
+        """Extract preferences using the async LLM client, answering repeated queries from the preference cache"""
+        cached = self.preference_cache.get(user_query)
+        if cached is not None:
+            return cached
+        
+        try:
+            response = await self._chat_completion_async(
+                self._extraction_messages(user_query),
+                temperature=0.1,
+                max_tokens=800
+            )
+            
+            preferences = self._parse_extraction(response.choices[0].message.content)
+            if preferences is None:
+                return self._fallback_extraction(user_query)
+            
+            self.preference_cache.set(user_query, preferences)
+            return preferences
+        
+        except Exception as e:
+            print(f"Error in LLM extraction: {e!r}")
+            return self._fallback_extraction(user_query)
+    
+    async def _chat_completion_async(self, messages: List[Dict], temperature: float, max_tokens: int):
+        """Run a chat completion on the async client, bounded by the concurrency semaphore and timeout"""
+        async with self.llm_semaphore:
+            return await asyncio.wait_for(
+                self.async_client.chat.completions.create(
+                    messages=messages,
+                    model=self.model,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                ),
+                timeout=self.llm_timeout
+            )
+    
     def combine_preferences(self, llm_prefs: Dict, category_scores: Dict, user_query: str) -> Dict:
         """Combine LLM and basic matching preferences"""
         
@@ -204,6 +767,9 @@ class EnhancedAIEngine:
         
         enhanced_prefs['extracted_keywords'] = extracted_keywords
         
+        # Ranking retrieves against the user's own words, whichever path extracted the rest
+        enhanced_prefs['original_query'] = user_query
+        
         # Calculate confidence scores
         enhanced_prefs['confidence_scores'] = {
             'llm_confidence': self._calculate_llm_confidence(llm_prefs),
@@ -236,161 +802,299 @@ class EnhancedAIEngine:
     
     def calculate_enhanced_recommendation_score(self, product: Dict, preferences: Dict) -> Tuple[float, str]:
         """Calculate enhanced recommendation score for a product"""
-        
-        score = 0.0
-        reasoning_parts = []
-        
+        batch = self.score_products_batch([product], preferences)
+        return float(batch.scores[0]), batch.reasoning(0)
+
+    def score_products_batch(self, products, preferences: Dict,
+                             text_similarity: Optional[np.ndarray] = None) -> "RecommendationBatch":
+        """Score a whole candidate set (CatalogView or product dicts) as array operations over its columns"""
+        # text_similarity may come precomputed for original_query (speculative
+        # prefetch); product dicts and reasoning are built lazily by the batch
+        products = CatalogView.of(products)
+        snapshot = products.snapshot
+        n = len(products)
+        context = self._scoring_context(preferences)
+        context['matched_tag_ids'] = self._matched_tags(snapshot, context)
+        context['matched_tags'] = {snapshot.tag_names[tag_id] for tag_id in context['matched_tag_ids']}
+
+        prices = products.column('prices')
+        ratings = np.nan_to_num(products.column('ratings'))  # NULL ratings score as 0, the column default
+
+        scores = np.zeros(n)
+
         # Category matching (30%)
-        if preferences.get('category') == product['category']:
-            score += 0.3
-            reasoning_parts.append(f"Perfect category match ({product['category']})")
-        elif preferences.get('category') == 'both':
-            score += 0.2
-            reasoning_parts.append(f"Category compatible ({product['category']})")
-        
-        # Product type matching (special bonus 20%)
-        extracted_keywords = preferences.get('extracted_keywords', [])
-        product_name_lower = product['name'].lower()
-        product_tags_lower = [tag.lower() for tag in product.get('tags', [])]
-        
-        for keyword in extracted_keywords:
-            keyword_lower = keyword.lower()
-            # Check for t-shirt specific matches
-            if keyword_lower in ['t-shirt', 'tshirt', 'tee']:
-                if any(tag in ['tee', 'tshirt'] for tag in product_tags_lower) or 'tee' in product_name_lower:
-                    score += 0.2
-                    reasoning_parts.append(f"Perfect product type match ({keyword})")
-                    break
-            # Check for other direct matches
-            elif keyword_lower in product_name_lower or any(keyword_lower in tag for tag in product_tags_lower):
-                score += 0.15
-                reasoning_parts.append(f"Product type match ({keyword})")
-                break
-        
-        # Subcategory matching (bonus 15%)
-        if preferences.get('subcategory') and product.get('subcategory'):
-            if preferences.get('subcategory').lower() in product.get('subcategory', '').lower():
-                score += 0.15
-                reasoning_parts.append(f"Subcategory match ({product['subcategory']})")
-            elif product.get('subcategory', '').lower() in preferences.get('subcategory', '').lower():
-                score += 0.1
-                reasoning_parts.append(f"Subcategory compatible ({product['subcategory']})")
-        
+        compatible = 0.2 if context['category'] == 'both' else 0.0
+        category_code = snapshot.code('category', context['category'])
+        scores += np.where(products.column('category_codes') == category_code, 0.3, compatible)
+
+        # Product type (special bonus 20%): the first keyword found in a product's name or tags decides
+        keyword_scores = np.zeros(n)
+        undecided = np.ones(n, dtype=bool)
+        names_lower = products.column('names_lower')
+        for keyword_lower in context['extracted_keywords']:
+            if keyword_lower in self.TSHIRT_KEYWORDS:
+                tag_ids, needle, value = self._tag_ids(snapshot, self.TSHIRT_TAGS), 'tee', 0.2
+            else:
+                tag_ids, needle, value = snapshot.tag_index().containing(keyword_lower), keyword_lower, 0.15
+            hit = products.tag_counts(tag_ids) > 0
+            hit |= np.fromiter((needle in name for name in names_lower), dtype=bool, count=n)
+            keyword_scores[hit & undecided] = value
+            undecided &= ~hit
+
+        # Subcategory matching (bonus 15%): scores depend only on the subcategory, so score each distinct value once
+        subcategory_table = np.array(
+            [self._subcategory_match(subcategory, context)[0] for subcategory in snapshot.subcategories]
+        )
+        subcategory_scores = subcategory_table[products.column('subcategory_codes')] if n else np.zeros(0)
+        scores += keyword_scores
+        scores += subcategory_scores
+
         # Price matching (25%)
-        budget_max = preferences.get('budget_max', 0)
+        budget_max = context['budget_max']
         if budget_max > 0:
-            if product['price'] <= budget_max:
-                price_score = 0.25 * (1 - (product['price'] / budget_max) * 0.5)
-                score += price_score
-                reasoning_parts.append(f"Within budget (₹{product['price']} ≤ ₹{budget_max})")
-            else:
-                reasoning_parts.append(f"Over budget (₹{product['price']} > ₹{budget_max})")
+            scores += np.where(prices <= budget_max, 0.25 * (1 - (prices / budget_max) * 0.5), 0.0)
         else:
-            score += 0.15  # Neutral score if no budget specified
-            reasoning_parts.append("No budget constraint")
-        
-        # Tag/preference matching (25%)
-        product_tags = set(product.get('tags', []))
-        user_prefs = set(preferences.get('dietary_preferences', []) + 
-                        preferences.get('style_preferences', []) + 
-                        preferences.get('specific_requirements', []) +
-                        preferences.get('extracted_keywords', []))
-        
-        # Also check for partial matches in product tags
-        product_tags_lower = set([tag.lower() for tag in product_tags])
-        user_prefs_lower = set([pref.lower() for pref in user_prefs])
-        
-        # Check for exact matches
-        exact_matches = product_tags_lower.intersection(user_prefs_lower)
-        
-        # Check for meaningful partial matches (at least 3 characters)
-        partial_matches = set()
-        for user_pref in user_prefs_lower:
-            if len(user_pref) >= 3:  # Only consider meaningful words
-                for product_tag in product_tags_lower:
-                    if len(product_tag) >= 3:  # Only consider meaningful tags
-                        # Special case for t-shirt variations
-                        if (user_pref in ["t-shirt", "tshirt"] and product_tag in ["tee", "tshirt", "t-shirt"]) or \
-                           (user_pref == "tee" and product_tag in ["tshirt", "t-shirt"]):
-                            partial_matches.add(product_tag)
-                        # Check if words contain each other (but not single letters)
-                        elif (user_pref in product_tag or product_tag in user_pref) and \
-                             len(user_pref) > 2 and not any(c.isdigit() for c in user_pref):
-                            partial_matches.add(product_tag)
-        
-        all_matches = exact_matches.union(partial_matches)
-        
-        if user_prefs:
-            if all_matches:
-                # Give higher score for more matches
-                tag_score = 0.25 * min(1.0, len(all_matches) / max(1, len(user_prefs_lower)))
-                
-                # Special bonus for t-shirt matches
-                if any(match in ["tee", "tshirt"] for match in all_matches):
-                    tag_score += 0.15  # Extra bonus for t-shirt matches
-                    reasoning_parts.append(f"T-shirt match: {', '.join(list(all_matches)[:3])}")
-                else:
-                    reasoning_parts.append(f"Matches preferences: {', '.join(list(all_matches)[:3])}")
-                
-                score += tag_score
-            else:
-                reasoning_parts.append("No specific preference matches")
+            scores += 0.15  # Neutral score if no budget specified
+
+        # Tag/preference matching (25%): count each product's tags among the matched ones
+        if context['user_prefs']:
+            matched = context['matched_tag_ids']
+            tag_scores = 0.25 * np.minimum(1.0, products.tag_counts(matched) / max(1, len(context['user_prefs_lower'])))
+            tshirt_tags = [tag_id for tag_id in self._tag_ids(snapshot, self.TSHIRT_TAGS) if tag_id in matched]
+            if tshirt_tags:
+                tag_scores += np.where(products.tag_counts(tshirt_tags) > 0, 0.15, 0.0)  # Extra bonus for t-shirt matches
+            scores += tag_scores
         else:
-            score += 0.1  # Neutral score if no preferences
-        
+            scores += 0.1  # Neutral score if no preferences
+
         # Brand matching (10%)
-        brand_prefs = preferences.get('brand_preferences', [])
-        if brand_prefs:
-            if product['brand'] in brand_prefs:
-                score += 0.1
-                reasoning_parts.append(f"Preferred brand ({product['brand']})")
-            else:
-                reasoning_parts.append(f"Different brand ({product['brand']})")
+        if context['brand_prefs']:
+            preferred_codes = [snapshot.code('brand', brand) for brand in context['brand_prefs']]
+            preferred = np.isin(products.column('brand_codes'), preferred_codes)
+            scores += np.where(preferred, 0.1, 0.0)
         else:
-            score += 0.05  # Neutral score
-        
+            scores += 0.05  # Neutral score
+
         # Rating boost (10%)
-        rating_score = (product.get('rating', 3) / 5) * 0.1
-        score += rating_score
-        reasoning_parts.append(f"Quality rating: {product.get('rating', 3)}/5")
-        
+        scores += (ratings / 5) * 0.1
+
         # Text similarity with product description
-        if hasattr(self, 'product_vectors') and self.product_vectors is not None:
-            try:
-                user_query_vector = self.vectorizer.transform([preferences.get('original_query', '')])
-                product_idx = self.product_descriptions.index(
-                    f"{product['name']} {product['brand']} {product['category']} {' '.join(product.get('tags', []))}"
-                )
-                text_sim = cosine_similarity(user_query_vector, self.product_vectors[product_idx:product_idx+1])[0][0]
-                score += text_sim * 0.1
-                if text_sim > 0.3:
-                    reasoning_parts.append(f"High text similarity ({text_sim:.2f})")
-            except:
-                pass
-        
+        if text_similarity is None:
+            text_similarity = self.text_similarity(products, preferences.get('original_query', ''))
+        if text_similarity is not None:
+            scores += text_similarity * 0.1
+
         # Ensure score is between 0 and 1
-        score = max(0, min(1, score))
-        
-        # Create reasoning string
-        reasoning = " • ".join(reasoning_parts)
-        
-        return score, reasoning
-    
-    def generate_enhanced_response(self, user_query: str, recommendations: List[Dict], preferences: Dict) -> str:
-        """Generate enhanced personalized AI response"""
-        
-        if not recommendations:
-            return self._generate_no_results_response(user_query, preferences)
-        
-        # Prepare context for LLM
-        context = {
-            'user_query': user_query,
-            'preferences': preferences,
-            'recommendations': recommendations[:5],  # Top 5 for context
-            'category_insights': preferences.get('semantic_matches', {}),
-            'confidence_scores': preferences.get('confidence_scores', {})
+        scores = np.clip(scores, 0, 1)
+
+        return RecommendationBatch(self, products, context, scores, text_similarity)
+
+    def query_scores(self, products, query: str) -> np.ndarray:
+        """Stage-one BM25 scores of products for the raw query"""
+        products = CatalogView.of(products)
+        return products.snapshot.text_index().score_text(query)[products.rows]
+
+    def retrieve_candidates(self, products, preferences: Dict,
+                            query_scores: Optional[np.ndarray] = None,
+                            query_vector: Optional[np.ndarray] = None) -> np.ndarray:
+        """Stage one: positions (in catalog order) of the candidate_limit best BM25 matches"""
+        # query_scores may come precomputed for original_query; with a
+        # query_vector (dense backend) the nearest neighbours that pass the
+        # filters come first and BM25 fills the remaining slots
+        products = CatalogView.of(products)
+        dense_hits = np.zeros(0, dtype=np.int64)
+        if query_vector is not None:
+            dense_hits = self._dense_candidates(products, query_vector)
+            if len(dense_hits) >= self.candidate_limit:
+                return np.sort(dense_hits)
+        index = products.snapshot.text_index()
+        query_terms = index.terms(preferences.get('original_query', ''))
+        if query_scores is None:
+            query_scores = index.scores(query_terms)[products.rows]
+
+        preference_text = ' '.join(
+            preferences.get('extracted_keywords', []) + preferences.get('dietary_preferences', []) +
+            preferences.get('style_preferences', []) + preferences.get('specific_requirements', []) +
+            preferences.get('brand_preferences', []) + [preferences.get('subcategory') or '']
+        )
+        preference_terms = [term for term in index.terms(preference_text) if term not in query_terms]
+        scores = query_scores + index.scores(preference_terms)[products.rows]
+        scores = scores + np.nan_to_num(products.column('ratings')) * 1e-3  # ties go to higher-rated products
+        scores[dense_hits] = np.inf
+
+        candidates = np.argpartition(-scores, self.candidate_limit - 1)[:self.candidate_limit]
+        candidates.sort()  # stage two breaks ties by catalog order
+        return candidates
+
+    def _dense_candidates(self, products: CatalogView, query_vector: np.ndarray) -> np.ndarray:
+        """Positions in products of the (at most candidate_limit) nearest neighbours of query_vector"""
+        ids, similarity = self.dense.index.search(query_vector)
+        rows = products.snapshot.rows_of(ids)
+        position = np.full(len(products.snapshot), -1, dtype=np.int64)
+        position[products.rows] = np.arange(len(products))
+        positions = np.where(rows >= 0, position[rows], -1)
+        keep = positions >= 0  # drops neighbours filtered out by category/budget/availability
+        positions, similarity = positions[keep], similarity[keep]
+        if len(positions) > self.candidate_limit:
+            best = np.argpartition(-similarity, self.candidate_limit - 1)[:self.candidate_limit]
+            positions = positions[best]
+        return positions
+
+    def recommend_top_k(self, products, preferences: Dict, k: int = 10,
+                        text_similarity: Optional[np.ndarray] = None,
+                        query_scores: Optional[np.ndarray] = None) -> List[Dict]:
+        """Score the candidates and materialize only the k best as recommendation dicts"""
+        products = CatalogView.of(products)
+        query_vector = self.dense.encode_query(preferences.get('original_query', '')) if self.dense else None
+        # Large candidate sets are narrowed first, so the full scorer only
+        # runs on a few hundred products however large the catalog is
+        if len(products) > self.candidate_limit:
+            candidates = self.retrieve_candidates(products, preferences, query_scores, query_vector)
+            products = products.subset(candidates)
+            if text_similarity is not None:
+                text_similarity = text_similarity[candidates]
+        if query_vector is not None and text_similarity is None:
+            # Dense backend: embedding similarity takes the place of TF-IDF cosine in the score
+            text_similarity = np.maximum(self.dense.index.similarity(products.column('ids'), query_vector), 0.0)
+        batch = self.score_products_batch(products, preferences, text_similarity)
+        confidence = batch.confidence
+        return [
+            {
+                **batch.product(i),
+                'confidence': int(confidence[i]),
+                'reasoning': batch.reasoning(i)
+            }
+            for i in batch.top_k(k)
+        ]
+
+    def _scoring_context(self, preferences: Dict) -> Dict:
+        """Preference-derived values shared by every product in a batch"""
+        user_prefs = set(preferences.get('dietary_preferences', []) +
+                        preferences.get('style_preferences', []) +
+                        preferences.get('specific_requirements', []) +
+                        preferences.get('extracted_keywords', []))
+        return {
+            'category': preferences.get('category'),
+            'subcategory': preferences.get('subcategory'),
+            'budget_max': preferences.get('budget_max', 0),
+            'brand_prefs': preferences.get('brand_preferences', []),
+            'extracted_keywords': [keyword.lower() for keyword in preferences.get('extracted_keywords', [])],
+            'raw_keywords': preferences.get('extracted_keywords', []),
+            'user_prefs': user_prefs,
+            'user_prefs_lower': set([pref.lower() for pref in user_prefs]),
         }
-        
+
+    def text_similarity(self, products, query: str) -> Optional[np.ndarray]:
+        """Cosine similarity between the query and each product's TF-IDF row"""
+        products = CatalogView.of(products)
+        with self._index_lock:
+            if self.product_vectors is None:
+                return None
+
+            query_vector = self.transform_query(query)
+            product_vectors = self.product_vectors
+            rows = self._description_rows(products.snapshot)[products.rows]
+
+        known = rows >= 0
+        similarity = np.zeros(len(products))
+        if known.any():
+            # TF-IDF rows are L2-normalised, so the dot product is the cosine
+            similarity[known] = (product_vectors[rows[known]] @ query_vector.T).toarray().ravel()
+        return similarity
+
+    def _description_rows(self, snapshot: CatalogSnapshot) -> np.ndarray:
+        """product_vectors row of every snapshot product (-1 if not indexed), kept until
+        the snapshot or the index changes; call with _index_lock held"""
+        cached_snapshot, generation, rows = self._description_row_cache
+        if cached_snapshot is not snapshot or generation != self._index_generation:
+            product_index = self.product_index
+            rows = np.fromiter((product_index.get(product_id, -1) for product_id in snapshot.ids.tolist()),
+                               dtype=np.int64, count=len(snapshot))
+            self._description_row_cache = (snapshot, self._index_generation, rows)
+        return rows
+
+    TSHIRT_KEYWORDS = ('t-shirt', 'tshirt', 'tee')
+    TSHIRT_TAGS = ('tee', 'tshirt')
+
+    @staticmethod
+    def _tag_ids(snapshot: CatalogSnapshot, tags) -> List[int]:
+        """Vocabulary ids of those tags that occur in the catalog"""
+        return [snapshot.tag_vocabulary[tag] for tag in tags if tag in snapshot.tag_vocabulary]
+
+    def _matched_tags(self, snapshot: CatalogSnapshot, context: Dict) -> Set[int]:
+        """Ids of the catalog tags that match a user preference, resolved once per request.
+
+        A tag matches a preference exactly, through the t-shirt/tee synonyms,
+        or (both at least 3 characters, no digits in the preference) when
+        either contains the other. The substring cases are answered by the
+        snapshot's tag index instead of comparing every preference with every
+        tag of every product.
+        """
+        vocabulary = snapshot.tag_vocabulary
+        index = snapshot.tag_index()
+        matched = set()
+        for user_pref in context['user_prefs_lower']:
+            if user_pref in vocabulary:
+                matched.add(vocabulary[user_pref])
+            if len(user_pref) < 3:  # Only consider meaningful words
+                continue
+            # Special case for t-shirt variations
+            if user_pref in ("t-shirt", "tshirt"):
+                matched.update(self._tag_ids(snapshot, ("tee", "tshirt", "t-shirt")))
+            elif user_pref == "tee":
+                matched.update(self._tag_ids(snapshot, ("tshirt", "t-shirt")))
+            # Words containing each other (but not single letters)
+            if not any(c.isdigit() for c in user_pref):
+                matched.update(tag_id for tag_id in index.containing(user_pref) | index.contained_in(user_pref)
+                               if len(index.terms[tag_id]) >= 3)
+        return matched
+
+    def _keyword_match(self, product_name_lower: str, product_tags_lower: Tuple[str, ...],
+                       context: Dict) -> Tuple[float, Optional[str]]:
+        """Product type matching against extracted keywords (lowercased name and tags)"""
+
+        for keyword, keyword_lower in zip(context['raw_keywords'], context['extracted_keywords']):
+            # Check for t-shirt specific matches
+            if keyword_lower in ['t-shirt', 'tshirt', 'tee']:
+                if any(tag in ['tee', 'tshirt'] for tag in product_tags_lower) or 'tee' in product_name_lower:
+                    return 0.2, f"Perfect product type match ({keyword})"
+            # Check for other direct matches
+            elif keyword_lower in product_name_lower or any(keyword_lower in tag for tag in product_tags_lower):
+                return 0.15, f"Product type match ({keyword})"
+        return 0.0, None
+
+    def _subcategory_match(self, subcategory: Optional[str], context: Dict) -> Tuple[float, Optional[str]]:
+        """Subcategory matching in either direction"""
+        preferred = context['subcategory']
+        if preferred and subcategory:
+            if preferred.lower() in subcategory.lower():
+                return 0.15, f"Subcategory match ({subcategory})"
+            elif subcategory.lower() in preferred.lower():
+                return 0.1, f"Subcategory compatible ({subcategory})"
+        return 0.0, None
+
+    def _tag_match(self, tag_terms: Tuple[str, ...], context: Dict) -> Tuple[float, Optional[str]]:
+        """Product tags among the ones matching user preferences (see _matched_tags)"""
+        user_prefs_lower = context['user_prefs_lower']
+        if not context['user_prefs']:
+            return 0.0, None
+
+        all_matches = [tag for tag in tag_terms if tag in context['matched_tags']]  # in the product's tag order
+
+        if not all_matches:
+            return 0.0, "No specific preference matches"
+
+        # Give higher score for more matches
+        tag_score = 0.25 * min(1.0, len(all_matches) / max(1, len(user_prefs_lower)))
+
+        # Special bonus for t-shirt matches
+        if any(match in ["tee", "tshirt"] for match in all_matches):
+            tag_score += 0.15  # Extra bonus for t-shirt matches
+            return tag_score, f"T-shirt match: {', '.join(all_matches[:3])}"
+        return tag_score, f"Matches preferences: {', '.join(all_matches[:3])}"
+    
+    def _response_messages(self, user_query: str, recommendations: List[Dict], preferences: Dict) -> List[Dict]:
+        """Chat messages asking the LLM for the Mitra response"""
         prompt = f"""
         You are Mitra, an AI shopping assistant for Indian D2C brands. Create a personalized, helpful response.
         
@@ -419,23 +1123,101 @@ class EnhancedAIEngine:
         Keep the response conversational, informative, and actionable.
         """
         
+        return [
+            {"role": "system", "content": "You are Mitra, a friendly AI shopping assistant specializing in Indian D2C brands. You provide personalized, culturally relevant recommendations with enthusiasm and expertise."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def generate_enhanced_response(self, user_query: str, recommendations: List[Dict], preferences: Dict) -> str:
+        """Generate enhanced personalized AI response"""
+        
+        if not recommendations:
+            return self._generate_no_results_response(user_query, preferences)
+        
+        cached = self.response_cache.get(preferences, recommendations)
+        if cached is not None:
+            return cached
+        
         try:
             response = self.client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": "You are Mitra, a friendly AI shopping assistant specializing in Indian D2C brands. You provide personalized, culturally relevant recommendations with enthusiasm and expertise."},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=self._response_messages(user_query, recommendations, preferences),
                 model=self.model,
                 temperature=0.7,
                 max_tokens=1000
             )
             
-            return response.choices[0].message.content.strip()
+            ai_response = response.choices[0].message.content.strip()
+            self.response_cache.set(preferences, recommendations, ai_response)
+            return ai_response
             
         except Exception as e:
             print(f"Error generating AI response: {e}")
             return self._generate_fallback_response(user_query, recommendations)
     
+    async def generate_enhanced_response_async(self, user_query: str, recommendations: List[Dict], preferences: Dict) -> str:
+        """Generate the personalized AI response using the async LLM client"""
+        
+        if not recommendations:
+            return self._generate_no_results_response(user_query, preferences)
+        
+        cached = self.response_cache.get(preferences, recommendations)
+        if cached is not None:
+            return cached
+        
+        try:
+            response = await self._chat_completion_async(
+                self._response_messages(user_query, recommendations, preferences),
+                temperature=0.7,
+                max_tokens=1000
+            )
+            
+            ai_response = response.choices[0].message.content.strip()
+            self.response_cache.set(preferences, recommendations, ai_response)
+            return ai_response
+        
+        except Exception as e:
+            print(f"Error generating AI response: {e!r}")
+            return self._generate_fallback_response(user_query, recommendations)
+    
+    async def stream_enhanced_response(self, user_query: str, recommendations: List[Dict],
+                                       preferences: Dict) -> AsyncIterator[str]:
+        """Yield the personalized AI response token by token from the model's streaming API"""
+        
+        if not recommendations:
+            yield self._generate_no_results_response(user_query, preferences)
+            return
+        
+        cached = self.response_cache.get(preferences, recommendations)
+        if cached is not None:
+            yield cached
+            return
+        
+        async with self.llm_semaphore:
+            try:
+                stream = await asyncio.wait_for(
+                    self.async_client.chat.completions.create(
+                        messages=self._response_messages(user_query, recommendations, preferences),
+                        model=self.model,
+                        temperature=0.7,
+                        max_tokens=1000,
+                        stream=True
+                    ),
+                    timeout=self.llm_timeout
+                )
+            except Exception as e:
+                print(f"Error generating AI response: {e!r}")
+                yield self._generate_fallback_response(user_query, recommendations)
+                return
+            
+            tokens = []
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    tokens.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+            
+            # Only complete streams are cached
+            self.response_cache.set(preferences, recommendations, "".join(tokens).strip())
+    
     def _format_recommendations_for_prompt(self, recommendations: List[Dict]) -> str:
         """Format recommendations for LLM prompt"""
         formatted = ""
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Optional
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+
+def catalog_hash(descriptions: List[str], product_ids: List, vectorizer: TfidfVectorizer) -> str:
+    """Content hash of the catalog text and vectorizer settings an index was built from"""
+    digest = hashlib.sha256()
+    params = vectorizer.get_params()
+    digest.update(json.dumps(
+        {name: params[name] for name in ('max_features', 'ngram_range', 'stop_words', 'lowercase', 'norm')},
+        sort_keys=True, default=str
+    ).encode('utf-8'))
+    for product_id, description in zip(product_ids, descriptions):
+        digest.update(f"{product_id}\x1f{description}\x1e".encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+class IndexStore:
+    """On-disk TF-IDF vocabulary and product matrix, keyed by catalog content hash.
+
+    Each index lives in ``<directory>/<hash>/`` as the vocabulary (JSON), the
+    idf weights and the CSR arrays of the product matrix (``.npy``). The
+    matrix arrays are memory-mapped on load, so replicas sharing a volume
+    start without refitting or copying the matrix into private memory.
+    """
+
+    MATRIX_ARRAYS = ('data', 'indices', 'indptr')
+
+    def __init__(self, directory: str = "index_cache", keep: int = 2):
+        self.directory = directory
+        self.keep = keep
+
+    def load(self, key: str, vectorizer: TfidfVectorizer) -> Optional[Dict]:
+        """Restore a fitted vectorizer in place and return the stored matrix, or None on a miss"""
+        path = os.path.join(self.directory, key)
+        if not os.path.isdir(path):
+            return None
+
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+            with open(os.path.join(path, "vocabulary.json")) as f:
+                vocabulary = json.load(f)
+            idf = np.load(os.path.join(path, "idf.npy"))
+            arrays = {
+                name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+                for name in self.MATRIX_ARRAYS
+            }
+            product_ids = json.load(open(os.path.join(path, "product_ids.json")))
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable TF-IDF index {path}: {e}")
+            return None
+
+        vectorizer.vocabulary_ = vocabulary
+        vectorizer.idf_ = idf
+        matrix = sparse.csr_matrix(
+            (arrays['data'], arrays['indices'], arrays['indptr']),
+            shape=tuple(meta['shape']),
+            copy=False
+        )
+        return {'matrix': matrix, 'product_ids': product_ids}
+
+    def save(self, key: str, vectorizer: TfidfVectorizer, matrix: sparse.csr_matrix, product_ids: List):
+        """Persist a freshly fitted index, then prune older ones"""
+        os.makedirs(self.directory, exist_ok=True)
+        matrix = sparse.csr_matrix(matrix)
+        tmp_path = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+                json.dump({'shape': list(matrix.shape)}, f)
+            with open(os.path.join(tmp_path, "vocabulary.json"), "w") as f:
+                json.dump({term: int(column) for term, column in vectorizer.vocabulary_.items()}, f)
+            with open(os.path.join(tmp_path, "product_ids.json"), "w") as f:
+                json.dump(product_ids, f)
+            np.save(os.path.join(tmp_path, "idf.npy"), vectorizer.idf_)
+            for name in self.MATRIX_ARRAYS:
+                np.save(os.path.join(tmp_path, f"{name}.npy"), getattr(matrix, name))
+
+            final_path = os.path.join(self.directory, key)
+            if os.path.isdir(final_path):
+                shutil.rmtree(final_path)
+            os.replace(tmp_path, final_path)
+        except OSError as e:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            print(f"⚠️ Could not persist TF-IDF index: {e}")
+            return
+
+        self._prune(keep_key=key)
+
+    def _prune(self, keep_key: str):
+        """Remove all but the most recent ``keep`` indexes"""
+        entries = [
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+            if not name.startswith(".") and name != keep_key
+        ]
+        entries = sorted((path for path in entries if os.path.isdir(path)), key=os.path.getmtime, reverse=True)
+        for path in entries[max(0, self.keep - 1):]:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,421 @@
+import copy
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a shopping query used as a cache key"""
+    text = query.lower().strip()
+    # "rs 300", "rs.300", "inr 300", "300 rupees" -> "₹300"
+    text = re.sub(r'\b(?:rs\.?|inr)\s*(?=\d)', '₹', text)
+    text = re.sub(r'(\d+)\s*(?:rupees|rupee|rs\b\.?)', r'₹\1', text)
+    text = re.sub(r'₹\s+', '₹', text)
+    # Drop punctuation but keep hyphenated words (t-shirt) and amounts
+    text = re.sub(r"[^\w₹\s-]", " ", text)
+    return " ".join(text.split())
+
+
+class PreferenceCache:
+    """Cache of LLM preference extractions keyed on normalized queries.
+
+    Lookups try an exact match on the normalized query first, then a
+    near-duplicate match on the query's TF-IDF vector (cosine similarity at or
+    above ``similarity_threshold``). A near-duplicate must mention exactly the
+    same numbers, so "under ₹300" never answers "under ₹500", the same
+    negations ("tea without sugar" is not "tea with sugar"), and the same
+    words that ``unknown_words`` reports outside the TF-IDF vocabulary, which
+    the vectors cannot tell apart ("snacks for kids" / "for diabetics"). Entries are
+    evicted LRU-first beyond ``max_entries`` and expire after ``ttl_seconds``.
+    With a ``db_path`` they are also persisted to SQLite and reloaded on start.
+    """
+
+    def __init__(self, vectorize: Callable[[str], Optional[Tuple[np.ndarray, np.ndarray]]],
+                 max_entries: int = 1024, ttl_seconds: float = 3600,
+                 similarity_threshold: float = 0.92, db_path: Optional[str] = None,
+                 unknown_words: Optional[Callable[[str], FrozenSet[str]]] = None):
+        self.vectorize = vectorize
+        self.unknown_words = unknown_words
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.db_path = db_path
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> entry dict
+        self._postings = {}  # vocabulary column -> {key: weight}
+
+        if self.db_path:
+            self._init_db()
+            self._load()
+
+    def get(self, query: str) -> Optional[Dict]:
+        """Cached preferences for query (or a near-duplicate of it), else None"""
+        key = normalize_query(query)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry, now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry['preferences'])
+
+            near_key = self._nearest(key, now)
+            if near_key is not None:
+                self._entries.move_to_end(near_key)
+                self.near_hits += 1
+                return copy.deepcopy(self._entries[near_key]['preferences'])
+
+            self.misses += 1
+            return None
+
+    def set(self, query: str, preferences: Dict):
+        """Store the LLM preferences extracted for query"""
+        key = normalize_query(query)
+        entry = {
+            'preferences': copy.deepcopy(preferences),
+            'created_at': time.time(),
+            'guards': self._guards(key),
+            'vector': self._vector(key),
+        }
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._add(key, entry)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                evicted.append(oldest)
+
+        if self.db_path:
+            self._persist(key, entry, evicted)
+
+    def reindex(self):
+        """Recompute entry vectors, e.g. after the TF-IDF vocabulary was (re)fitted"""
+        with self._lock:
+            self._postings = {}
+            for key, entry in self._entries.items():
+                entry['vector'] = self._vector(key)
+                entry['guards'] = self._guards(key)
+                self._index(key, entry)
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'near_hits': self.near_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+    def _nearest(self, key: str, now: float) -> Optional[str]:
+        """Most similar live entry above the threshold with the same numbers, negations and unknown words"""
+        vector = self._vector(key)
+        if vector is None or not self._postings:
+            return None
+
+        guards = self._guards(key)
+        if guards is None:
+            return None
+        similarities = {}
+        for column, weight in zip(*vector):
+            for other, other_weight in self._postings.get(int(column), {}).items():
+                similarities[other] = similarities.get(other, 0.0) + weight * other_weight
+
+        best_key, best_score = None, self.similarity_threshold
+        for other, score in similarities.items():
+            entry = self._entries[other]
+            if score >= best_score and entry['guards'] == guards and not self._expired(entry, now):
+                best_key, best_score = other, score
+        return best_key
+
+    def _vector(self, key: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        try:
+            vector = self.vectorize(key)
+        except Exception:
+            return None
+        if vector is None or len(vector[0]) == 0:
+            return None
+        return vector
+
+    NEGATION = re.compile(r'\b(?:no|not|non|nor|never|without|except|excluding|free|less)\b|\b\w+(?:free|less)\b')
+
+    def _guards(self, key: str) -> Optional[Tuple]:
+        """What a near-duplicate must share exactly: numbers, negations and out-of-vocabulary words"""
+        numbers = tuple(sorted(re.findall(r'\d+', key)))
+        negations = tuple(sorted(set(self.NEGATION.findall(key))))
+        try:
+            unknown = frozenset(self.unknown_words(key)) if self.unknown_words else frozenset()
+        except Exception:
+            return None  # no near-duplicate matching for this query
+        return numbers, negations, unknown
+
+    def _expired(self, entry: Dict, now: float) -> bool:
+        return now - entry['created_at'] > self.ttl_seconds
+
+    def _add(self, key: str, entry: Dict):
+        self._entries[key] = entry
+        self._index(key, entry)
+
+    def _index(self, key: str, entry: Dict):
+        if entry['vector'] is None:
+            return
+        for column, weight in zip(*entry['vector']):
+            self._postings.setdefault(int(column), {})[key] = float(weight)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        if entry['vector'] is None:
+            return
+        for column in entry['vector'][0]:
+            postings = self._postings.get(int(column))
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[int(column)]
+
+    # Persistence
+
+    def _init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS preference_cache (
+                query_key TEXT PRIMARY KEY,
+                preferences TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def _load(self):
+        """Reload unexpired entries, oldest first so LRU order survives restarts"""
+        conn = sqlite3.connect(self.db_path)
+        cutoff = time.time() - self.ttl_seconds
+        conn.execute("DELETE FROM preference_cache WHERE created_at < ?", (cutoff,))
+        rows = conn.execute('''
+            SELECT query_key, preferences, created_at FROM (
+                SELECT * FROM preference_cache ORDER BY created_at DESC LIMIT ?
+            ) ORDER BY created_at
+        ''', (self.max_entries,)).fetchall()
+        conn.commit()
+        conn.close()
+
+        for key, preferences, created_at in rows:
+            self._add(key, {
+                'preferences': json.loads(preferences),
+                'created_at': created_at,
+                'guards': self._guards(key),
+                'vector': self._vector(key),
+            })
+
+    def _persist(self, key: str, entry: Dict, evicted: List[str]):
+        try:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute(
+                "INSERT OR REPLACE INTO preference_cache (query_key, preferences, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(entry['preferences']), entry['created_at'])
+            )
+            if evicted:
+                conn.executemany("DELETE FROM preference_cache WHERE query_key = ?", [(k,) for k in evicted])
+            conn.commit()
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠️ Could not persist preference cache entry: {e}")
+
+
+class ResponseCache:
+    """Cache of generated Mitra responses keyed by preferences and the ordered top-k product ids.
+
+    The key hashes the preference fields the response prompt depends on
+    (list fields are order-insensitive) together with the ids of the
+    recommended products in rank order. Each entry remembers the price and
+    availability of those products; an entry whose products have changed is
+    treated as stale, and ``invalidate_products`` drops entries eagerly when
+    the catalog is edited. Entries expire after ``ttl_seconds`` and are
+    evicted LRU-first once ``max_entries`` or ``max_bytes`` of response text
+    is exceeded.
+    """
+
+    PREFERENCE_FIELDS = (
+        'category', 'subcategory', 'budget_min', 'budget_max', 'dietary_preferences',
+        'style_preferences', 'specific_requirements', 'occasion',
+    )
+
+    def __init__(self, max_entries: int = 512, max_bytes: int = 8 * 1024 * 1024, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> entry dict
+        self._by_product = {}  # product id -> set of keys
+        self._bytes = 0
+
+    def key(self, preferences: Dict, recommendations: List[Dict]) -> str:
+        """Canonical hash of the relevant preference fields plus the ordered product ids"""
+        canonical = {}
+        for field in self.PREFERENCE_FIELDS:
+            value = preferences.get(field)
+            if isinstance(value, list):
+                value = sorted(str(item).strip().lower() for item in value)
+            elif isinstance(value, str):
+                value = value.strip().lower()
+            canonical[field] = value
+        canonical['products'] = [rec.get('id') for rec in recommendations]
+        payload = json.dumps(canonical, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def get(self, preferences: Dict, recommendations: List[Dict]) -> Optional[str]:
+        """Cached response for this preference/product combination, else None"""
+        key = self.key(preferences, recommendations)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                fresh = time.time() - entry['created_at'] <= self.ttl_seconds
+                if fresh and entry['fingerprint'] == self._fingerprint(recommendations):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry['response']
+                self._remove(key)
+
+            self.misses += 1
+            return None
+
+    def set(self, preferences: Dict, recommendations: List[Dict], response: str):
+        """Store a generated response"""
+        key = self.key(preferences, recommendations)
+        entry = {
+            'response': response,
+            'created_at': time.time(),
+            'fingerprint': self._fingerprint(recommendations),
+            'product_ids': [rec.get('id') for rec in recommendations],
+            'size': len(response.encode('utf-8')),
+        }
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if entry['size'] > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._bytes += entry['size']
+            for product_id in entry['product_ids']:
+                self._by_product.setdefault(product_id, set()).add(key)
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_products(self, product_ids) -> int:
+        """Drop every response that recommended one of these products; returns the number dropped"""
+        with self._lock:
+            keys = set()
+            for product_id in product_ids:
+                keys |= self._by_product.get(product_id, set())
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    @staticmethod
+    def _fingerprint(recommendations: List[Dict]) -> Tuple:
+        return tuple((rec.get('price'), rec.get('availability')) for rec in recommendations)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry['size']
+        for product_id in entry['product_ids']:
+            keys = self._by_product.get(product_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_product[product_id]
+
+
+class QueryVectorCache:
+    """Bounded LRU of query vectors (TF-IDF terms or dense embeddings) keyed by normalized query.
+
+    Keys are ``(space, normalize_query(query))`` so several vector spaces can
+    share one cache; owners ``clear`` a space when its model changes (e.g. a
+    TF-IDF refit). Vectors are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (space, key) -> vector
+
+    def get_or_compute(self, space: str, query: str, compute: Callable[[str], object]):
+        """Cached vector for query, else ``compute(normalized query)`` stored and returned"""
+        key = (space, normalize_query(query))
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        vector = compute(key[1])
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return vector
+
+    def clear(self, space: Optional[str] = None):
+        """Drop every vector, or only those of one space"""
+        with self._lock:
+            if space is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == space]:
+                    del self._entries[key]
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,225 @@
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+
+class RecommendationLogStore:
+    """Recommendation logs in daily partition files, compacted and pruned in the background.
+
+    Rows go to ``<directory>/recommendations_<YYYY-MM-DD>.sqlite`` by the
+    (UTC) day of their timestamp, each with a ``recommendations_log`` table
+    indexed on ``timestamp``. Partitions older than ``compact_after_days``
+    are exported to Parquet (gzip CSV if no Parquet engine is installed) and
+    their SQLite file removed; anything older than ``retention_days`` is
+    deleted. The main database never grows with traffic.
+    """
+
+    PARTITION_PATTERN = re.compile(r'^recommendations_(\d{4}-\d{2}-\d{2})\.(sqlite|parquet|csv\.gz)$')
+
+    def __init__(self, directory: str = "logs", retention_days: Optional[int] = None,
+                 compact_after_days: Optional[int] = None, maintenance_interval_seconds: Optional[float] = None):
+        self.directory = directory
+        # Settings are read here, not in the signature, so a .env loaded after import applies
+        if retention_days is None:
+            retention_days = int(os.getenv("LOG_RETENTION_DAYS", 30))
+        if compact_after_days is None:
+            compact_after_days = int(os.getenv("LOG_COMPACT_AFTER_DAYS", 2))
+        if maintenance_interval_seconds is None:
+            maintenance_interval_seconds = float(os.getenv("LOG_MAINTENANCE_INTERVAL_SECONDS", 3600))
+        self.retention_days = retention_days
+        self.compact_after_days = max(1, compact_after_days)  # never compact the partition being written
+        self.maintenance_interval = maintenance_interval_seconds
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connections = {}  # day -> open partition connection
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def log_recommendations(self, rows: List[Tuple[str, str, str, str, str]]):
+        """Append (timestamp, user_query, user_preferences, recommended_products,
+        confidence_scores) rows to their daily partitions"""
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(row[0][:10], []).append(row)
+
+        with self._lock:
+            for day, day_rows in by_day.items():
+                conn = self._partition(day)
+                with conn:
+                    conn.executemany('''
+                        INSERT INTO recommendations_log (timestamp, user_query, user_preferences,
+                                                         recommended_products, confidence_scores)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', day_rows)
+
+    def migrate_from(self, db_manager, chunk_size: int = 5000) -> int:
+        """Move rows still in the main database's recommendations_log into partitions"""
+        moved = 0
+        while True:
+            with db_manager.connection() as conn:
+                rows = conn.execute('''
+                    SELECT id, timestamp, user_query, user_preferences, recommended_products, confidence_scores
+                    FROM recommendations_log ORDER BY id LIMIT ?
+                ''', (chunk_size,)).fetchall()
+                if not rows:
+                    break
+                self.log_recommendations([row[1:] for row in rows])
+                conn.execute("DELETE FROM recommendations_log WHERE id <= ?", (rows[-1][0],))
+            moved += len(rows)
+
+        if moved:
+            print(f"✅ Moved {moved} recommendation logs out of the main database")
+        return moved
+
+    def partitions(self) -> Dict[str, List[str]]:
+        """Partition file names by day"""
+        days = {}
+        for name in sorted(os.listdir(self.directory)):
+            match = self.PARTITION_PATTERN.match(name)
+            if match:
+                days.setdefault(match.group(1), []).append(name)
+        return days
+
+    def stats(self) -> Dict:
+        """Partition counts and on-disk size"""
+        partitions = self.partitions()
+        names = [name for day_names in partitions.values() for name in day_names]
+        return {
+            'days': len(partitions),
+            'live_partitions': sum(name.endswith('.sqlite') for name in names),
+            'compacted_partitions': sum(not name.endswith('.sqlite') for name in names),
+            'bytes': sum(os.path.getsize(os.path.join(self.directory, name)) for name in names),
+            'oldest_day': min(partitions) if partitions else None,
+        }
+
+    # Maintenance
+
+    def start(self):
+        """Run maintenance now and then every maintenance_interval in a background thread"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="recommendation-log-maintenance", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop background maintenance and close partition connections"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections = {}
+
+    def maintain(self, today: Optional[datetime] = None) -> Dict:
+        """Compact partitions past compact_after_days and delete those past retention_days"""
+        today = (today or datetime.now(timezone.utc)).date()
+        compact_before = (today - timedelta(days=self.compact_after_days)).isoformat()
+        retain_from = (today - timedelta(days=self.retention_days)).isoformat()
+        compacted, deleted = 0, 0
+
+        for day, names in self.partitions().items():
+            if day < retain_from:
+                with self._lock:
+                    self._close(day)
+                    for name in names:
+                        self._remove(name)
+                deleted += 1
+            elif day < compact_before and f"recommendations_{day}.sqlite" in names:
+                if self._compact(day):
+                    compacted += 1
+
+        if compacted or deleted:
+            print(f"🧹 Recommendation logs: compacted {compacted}, deleted {deleted} daily partitions")
+        return {'compacted': compacted, 'deleted': deleted}
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.maintain()
+            except Exception as e:
+                print(f"⚠️ Recommendation log maintenance failed: {e}")
+            self._stopping.wait(self.maintenance_interval)
+
+    def _compact(self, day: str) -> bool:
+        """Export one SQLite partition to a compressed columnar file and drop the SQLite file"""
+        name = f"recommendations_{day}.sqlite"
+        with self._lock:
+            self._close(day)
+            conn = sqlite3.connect(os.path.join(self.directory, name))
+            try:
+                frame = pd.read_sql_query("SELECT * FROM recommendations_log ORDER BY timestamp, id", conn)
+            finally:
+                conn.close()
+
+            try:
+                # Late rows for a day that was already compacted are merged into its export
+                for existing in self.partitions().get(day, []):
+                    if existing != name:
+                        frame = pd.concat([self._read_compacted(existing), frame], ignore_index=True)
+
+                target = os.path.join(self.directory, f"recommendations_{day}.parquet")
+                try:
+                    frame.to_parquet(target + ".tmp", index=False)
+                except ImportError:
+                    # No pyarrow/fastparquet installed: gzip CSV still compresses the JSON columns well
+                    target = os.path.join(self.directory, f"recommendations_{day}.csv.gz")
+                    frame.to_csv(target + ".tmp", compression="gzip", index=False)
+                os.replace(target + ".tmp", target)
+            except Exception as e:
+                print(f"⚠️ Could not compact recommendation logs for {day}: {e}")
+                return False
+
+            for existing in self.partitions().get(day, []):
+                if existing != os.path.basename(target):
+                    self._remove(existing)
+        return True
+
+    def _read_compacted(self, name: str) -> pd.DataFrame:
+        path = os.path.join(self.directory, name)
+        if name.endswith('.parquet'):
+            return pd.read_parquet(path)
+        return pd.read_csv(path, compression="gzip")
+
+    def _partition(self, day: str) -> sqlite3.Connection:
+        conn = self._connections.get(day)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.directory, f"recommendations_{day}.sqlite"), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS recommendations_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_query TEXT NOT NULL,
+                    user_preferences TEXT,
+                    recommended_products TEXT,
+                    confidence_scores TEXT,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_recommendations_log_timestamp ON recommendations_log(timestamp)")
+            conn.commit()
+            self._connections[day] = conn
+            # Only the current day (and a straggler from yesterday) is normally being written
+            while len(self._connections) > 2:
+                self._close(min(other for other in self._connections if other != day))
+        return conn
+
+    def _close(self, day: str):
+        conn = self._connections.pop(day, None)
+        if conn is not None:
+            conn.close()
+
+    def _remove(self, name: str):
+        for path in (name, name + "-wal", name + "-shm"):
+            try:
+                os.remove(os.path.join(self.directory, path))
+            except FileNotFoundError:
+                pass
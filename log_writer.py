@@ -0,0 +1,153 @@
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+
+class RecommendationLogWriter:
+    """Background writer that batches recommendation logs into group commits.
+
+    ``log`` only timestamps the request and puts a compact record (query,
+    preferences, recommended product ids and confidence scores) on a bounded
+    queue; a writer thread encodes records and inserts them with one
+    ``executemany`` per batch of ``batch_size`` rows or every
+    ``flush_interval_ms``, whichever comes first. When the queue is full new
+    records are dropped (and counted) rather than slowing requests down.
+    ``stop`` drains whatever is still queued.
+
+    ``sink`` is anything with a ``log_recommendations(rows)`` method: the
+    ``RecommendationLogStore`` or the ``DatabaseManager`` itself. Each
+    written batch is also folded into ``rollups`` (``AnalyticsRollups``)
+    when given.
+    """
+
+    def __init__(self, sink, rollups=None, batch_size: Optional[int] = None,
+                 flush_interval_ms: Optional[int] = None, max_queue: Optional[int] = None):
+        self.sink = sink
+        self.rollups = rollups
+        # Settings are read here, not in the signature, so a .env loaded after import applies
+        if batch_size is None:
+            batch_size = int(os.getenv("LOG_BATCH_SIZE", 100))
+        if flush_interval_ms is None:
+            flush_interval_ms = int(os.getenv("LOG_FLUSH_INTERVAL_MS", 200))
+        if max_queue is None:
+            max_queue = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000
+
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the writer thread"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="recommendation-log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Flush queued records and stop the writer thread"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        # Anything left (writer never started, or it timed out) is written inline
+        while not self._queue.empty():
+            self._write(self._next_batch())
+
+    def log(self, user_query: str, preferences: Dict, recommendations: List[Dict]) -> bool:
+        """Queue a recommendation for logging; returns False if it was dropped"""
+        record = (
+            datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),  # same format as CURRENT_TIMESTAMP
+            user_query,
+            preferences,
+            [rec.get('id') for rec in recommendations],
+            [rec.get('confidence') for rec in recommendations],
+            [rec.get('category') for rec in recommendations],  # for the rollups only
+        )
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                print(f"⚠️ Recommendation log queue full, {self.dropped} records dropped so far")
+            return False
+
+    def stats(self) -> Dict:
+        """Queue depth and write/drop counters"""
+        return {
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+    def _run(self):
+        while True:
+            try:
+                batch = self._next_batch()
+                if batch:
+                    self._write(batch)
+                elif self._stopping.is_set():
+                    return
+            except Exception as e:  # keep the writer alive; a dead thread would drop every later log
+                print(f"⚠️ Recommendation log writer error: {e}")
+
+    def _next_batch(self) -> List:
+        """Up to batch_size records, waiting at most flush_interval after the first one"""
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            if deadline is None:
+                timeout = self.flush_interval
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+            try:
+                record = self._queue.get(timeout=timeout) if not self._stopping.is_set() \
+                    else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            batch.append(record)
+        return batch
+
+    def _write(self, batch: List):
+        if not batch:
+            return
+        rows, encoded = [], []
+        for record in batch:
+            timestamp, user_query, preferences, product_ids, scores, _ = record
+            try:
+                rows.append((timestamp, user_query, json.dumps(preferences), json.dumps(product_ids), json.dumps(scores)))
+                encoded.append(record)
+            except (TypeError, ValueError) as e:
+                self.failed += 1
+                print(f"⚠️ Skipping recommendation log that cannot be encoded: {e}")
+        batch = encoded
+        if not rows:
+            return
+        try:
+            self.sink.log_recommendations(rows)
+            self.written += len(rows)
+        except Exception as e:
+            self.failed += len(rows)
+            print(f"⚠️ Could not write {len(rows)} recommendation logs: {e}")
+            return
+
+        if self.rollups is not None:
+            try:
+                self.rollups.update(batch)
+            except Exception as e:
+                print(f"⚠️ Could not update analytics rollups: {e}")
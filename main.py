@@ -1,13 +1,25 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, File, HTTPException, Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+import numpy as np
 import uvicorn
+import asyncio
+import base64
+import io
+import json
 import os
 from dotenv import load_dotenv
 
+from analytics import AnalyticsRollups
+from catalog_import import detect_format, import_products
+from catalog_snapshot import Catalog, CatalogSnapshot, CatalogView
 from database import DatabaseManager
 from enhanced_ai_engine_basic import EnhancedAIEngine
+from log_store import RecommendationLogStore
+from log_writer import RecommendationLogWriter
 
 load_dotenv()
 
@@ -26,10 +38,36 @@ app.add_middleware(
 db_manager = DatabaseManager()
 ai_engine = EnhancedAIEngine()
 
+# In-memory columnar catalog for the recommendation hot path
+catalog = Catalog(db_manager)
+
+# Recommendation logs are written off the request path, in batches, to
+# daily partitions outside the main database (LOG_DIR= keeps them in it)
+log_dir = os.getenv("LOG_DIR", "logs")
+log_store = RecommendationLogStore(log_dir) if log_dir else None
+if log_store:
+    log_store.migrate_from(db_manager)
+    log_store.start()
+# Dashboard rollups live in their own database, maintained by the log writer
+analytics = AnalyticsRollups(os.getenv("ANALYTICS_DB", "analytics.sqlite"))
+log_writer = RecommendationLogWriter(log_store or db_manager, analytics)
+log_writer.start()
+
+@app.on_event("shutdown")
+def flush_recommendation_logs():
+    log_writer.stop()
+    if log_store:
+        log_store.stop()
+
+# "speculative" overlaps stage-one retrieval with LLM extraction; "sequential"
+# extracts first and lets SQLite apply the category/budget filters
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "speculative").lower()
+
 # Initialize product embeddings
 print("🔄 Initializing product embeddings...")
 products = db_manager.get_products()
 ai_engine.generate_product_embeddings(products)
+catalog.current()  # load the snapshot and build its search indexes before the first request
 print("✅ System ready!")
 
 # Pydantic models
@@ -43,6 +81,39 @@ class RecommendationResponse(BaseModel):
     ai_response: str
     preferences_extracted: Dict
 
+class ProductCreate(BaseModel):
+    sku: Optional[str] = None
+    name: str
+    category: str
+    subcategory: Optional[str] = None
+    price: float
+    brand: str
+    description: Optional[str] = None
+    tags: Optional[List[str]] = None
+    dietary_info: Optional[str] = None
+    seasonal_relevance: Optional[str] = None
+    image_url: Optional[str] = None
+    availability: bool = True
+    rating: float = 0
+
+class ProductUpdate(BaseModel):
+    sku: Optional[str] = None
+    name: Optional[str] = None
+    category: Optional[str] = None
+    subcategory: Optional[str] = None
+    price: Optional[float] = None
+    brand: Optional[str] = None
+    description: Optional[str] = None
+    tags: Optional[List[str]] = None
+    dietary_info: Optional[str] = None
+    seasonal_relevance: Optional[str] = None
+    image_url: Optional[str] = None
+    availability: Optional[bool] = None
+    rating: Optional[float] = None
+
+# Fields a PATCH may omit but not set to null
+NON_NULLABLE_PRODUCT_FIELDS = ('name', 'category', 'price', 'brand', 'availability', 'rating')
+
 class ProductFilter(BaseModel):
     category: Optional[str] = None
     max_price: Optional[float] = None
@@ -52,72 +123,334 @@ class ProductFilter(BaseModel):
 async def root():
     return {"message": "Mitra AI Recommendation Assistant API", "status": "active"}
 
-@app.post("/recommend", response_model=RecommendationResponse)
-async def get_recommendations(query: UserQuery):
-    """Get enhanced personalized recommendations based on user query"""
+class ClientDisconnected(Exception):
+    """Raised when the HTTP client goes away before the response is ready"""
+
+async def run_until_disconnected(request: Request, coro):
+    """Await coro, cancelling it (and any in-flight LLM call) if the client disconnects"""
+    task = asyncio.ensure_future(coro)
+    
+    async def watch_disconnect():
+        while not task.done():
+            if await request.is_disconnected():
+                task.cancel()
+                return
+            await asyncio.sleep(0.1)
+    
+    watcher = asyncio.ensure_future(watch_disconnect())
     try:
+        return await task
+    except asyncio.CancelledError:
+        if task.cancelled() and watcher.done():
+            raise ClientDisconnected()
+        raise
+    finally:
+        watcher.cancel()
+
+def candidate_filters(preferences: Dict) -> Tuple[Optional[str], Optional[float]]:
+    """Category and budget filters implied by the extracted preferences"""
+    category = preferences.get('category') if preferences.get('category') != 'both' else None
+    max_price = preferences.get('budget_max') if preferences.get('budget_max', 0) > 0 else None
+    if 'budget' in preferences.get('profile_applied', []):
+        # A saved budget only steers ranking; budgets stated in the query filter
+        max_price = None
+    return category, max_price
+
+def prefetch_candidates(user_query: str) -> Tuple[CatalogView, np.ndarray]:
+    """Stage-one lexical scores over the whole catalog, independent of the extracted preferences"""
+    products = catalog.select()
+    if ai_engine.dense:
+        # Embed the query while the LLM runs; ranking then hits the query vector cache
+        ai_engine.dense.encode_query(user_query)
+    return products, ai_engine.query_scores(products, user_query)
+
+def filter_prefetched(products: CatalogView, query_scores: np.ndarray,
+                      category: Optional[str], max_price: Optional[float]):
+    """Apply the same category/budget filters as get_products to prefetched candidates"""
+    keep = products.mask(category, max_price)
+    return products.subset(keep), query_scores[keep]
+
+async def extract_preferences(user_query: str, user_id: Optional[str] = None) -> Tuple[Dict, Optional[Tuple[CatalogView, np.ndarray]]]:
+    """Extract preferences, personalized by the user's saved profile; in speculative mode also return the prefetched candidates"""
+    # Profiles are served from the DatabaseManager's in-process cache; a miss
+    # reads SQLite, which must not block the event loop
+    profile = None
+    if user_id:
+        hit, profile = db_manager.cached_user_preferences(user_id)
+        if not hit:
+            profile = await run_in_threadpool(db_manager.get_user_preferences, user_id)
+    
+    if PIPELINE_MODE != "speculative":
         # Extract user preferences using enhanced AI
-        preferences = ai_engine.extract_user_preferences_enhanced(query.query)
-        
-        # Get products from database based on preferences
-        products = db_manager.get_products(
-            category=preferences.get('category') if preferences.get('category') != 'both' else None,
-            max_price=preferences.get('budget_max') if preferences.get('budget_max', 0) > 0 else None,
+        preferences = await ai_engine.extract_user_preferences_enhanced_async(user_query, profile)
+        return preferences, None
+    
+    # Speculative mode: retrieve over the whole catalog while the LLM extracts
+    # preferences, then only filter and re-rank the prefetched candidates
+    prefetch = asyncio.ensure_future(run_in_threadpool(prefetch_candidates, user_query))
+    try:
+        preferences = await ai_engine.extract_user_preferences_enhanced_async(user_query, profile)
+        prefetched = await prefetch
+    finally:
+        prefetch.cancel()
+    return preferences, prefetched
+
+async def rank_candidates(preferences: Dict,
+                          prefetched: Optional[Tuple[CatalogView, np.ndarray]]) -> List[Dict]:
+    """Filter candidates by the extracted preferences and keep the top 10 recommendations"""
+    category, max_price = candidate_filters(preferences)
+    
+    if prefetched is None:
+        # Get products from the catalog snapshot based on preferences
+        products = await run_in_threadpool(
+            catalog.select,
+            category=category,
+            max_price=max_price,
             tags=None  # Don't filter by tags here, let the AI engine handle it
         )
-        
-        # Calculate enhanced recommendation scores
-        recommendations = []
-        for product in products:
-            score, reasoning = ai_engine.calculate_enhanced_recommendation_score(product, preferences)
-            
-            recommendations.append({
-                **product,
-                'confidence': round(score * 100),
-                'reasoning': reasoning
-            })
-        
-        # Sort by confidence score
-        recommendations.sort(key=lambda x: x['confidence'], reverse=True)
-        
-        # Take top 10 recommendations
-        top_recommendations = recommendations[:10]
-        
-        # Generate enhanced personalized AI response
-        ai_response = ai_engine.generate_enhanced_response(query.query, top_recommendations, preferences)
-        
-        # Log the recommendation
-        db_manager.log_recommendation(
-            query.query, 
-            preferences, 
-            top_recommendations, 
-            [rec['confidence'] for rec in top_recommendations]
-        )
-        
-        return RecommendationResponse(
-            query=query.query,
-            recommendations=top_recommendations,
-            ai_response=ai_response,
-            preferences_extracted=preferences
-        )
-        
+        query_scores = None
+    else:
+        # The prefetched scores are for the raw query, which is also what
+        # retrieval scores against (preferences['original_query'])
+        products, query_scores = filter_prefetched(*prefetched, category, max_price)
+    
+    # Narrow to BM25 candidates, score them fully and keep the top 10 recommendations
+    return await run_in_threadpool(ai_engine.recommend_top_k, products, preferences, 10, None, query_scores)
+
+async def retrieve_and_rank(user_query: str, user_id: Optional[str] = None) -> Tuple[Dict, List[Dict]]:
+    """Extract preferences, fetch candidates and keep the top 10 recommendations"""
+    preferences, prefetched = await extract_preferences(user_query, user_id)
+    return preferences, await rank_candidates(preferences, prefetched)
+
+async def build_recommendations(user_query: str, user_id: Optional[str] = None) -> RecommendationResponse:
+    """Run the recommendation pipeline without blocking the event loop"""
+    preferences, top_recommendations = await retrieve_and_rank(user_query, user_id)
+    
+    # Generate enhanced personalized AI response
+    ai_response = await ai_engine.generate_enhanced_response_async(user_query, top_recommendations, preferences)
+    
+    # Log the recommendation
+    log_writer.log(user_query, preferences, top_recommendations)
+    
+    return RecommendationResponse(
+        query=user_query,
+        recommendations=top_recommendations,
+        ai_response=ai_response,
+        preferences_extracted=preferences
+    )
+
+@app.post("/recommend", response_model=RecommendationResponse)
+async def get_recommendations(query: UserQuery, request: Request):
+    """Get enhanced personalized recommendations based on user query"""
+    try:
+        return await run_until_disconnected(request, build_recommendations(query.query, query.user_id))
+    except ClientDisconnected:
+        # Nobody is listening any more; 499 mirrors nginx's "client closed request"
+        return Response(status_code=499)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing recommendation: {str(e)}")
 
+def sse_event(event: str, data) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/recommend/stream")
+async def stream_recommendations(query: UserQuery):
+    """Stream recommendations as server-sent events.
+
+    Emits ``preferences`` as soon as they are extracted, then ``products``
+    with the ranked top-k, then the Mitra response as ``token`` events, and
+    finally ``done`` with the full response text.
+    """
+    async def event_stream():
+        try:
+            preferences, prefetched = await extract_preferences(query.query, query.user_id)
+            yield sse_event("preferences", preferences)
+            
+            top_recommendations = await rank_candidates(preferences, prefetched)
+            yield sse_event("products", top_recommendations)
+            
+            tokens = []
+            async for token in ai_engine.stream_enhanced_response(query.query, top_recommendations, preferences):
+                tokens.append(token)
+                yield sse_event("token", token)
+            ai_response = "".join(tokens)
+            yield sse_event("done", {"ai_response": ai_response})
+            
+            log_writer.log(query.query, preferences, top_recommendations)
+        except Exception as e:
+            yield sse_event("error", {"detail": f"Error processing recommendation: {str(e)}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+PRODUCTS_PAGE_SIZE = int(os.getenv("PRODUCTS_PAGE_SIZE", 50))
+PRODUCTS_MAX_PAGE_SIZE = int(os.getenv("PRODUCTS_MAX_PAGE_SIZE", 500))
+
+def encode_cursor(sort: str, position: Tuple) -> str:
+    """Opaque keyset cursor: the sort plus the (key, id) of the last row returned"""
+    return base64.urlsafe_b64encode(json.dumps([sort, *position]).encode()).decode()
+
+def decode_cursor(cursor: str, sort: str) -> Tuple:
+    try:
+        cursor_sort, key, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if cursor_sort != sort:
+        raise HTTPException(status_code=400, detail="Cursor was issued for a different sort")
+    return key, product_id
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f"W/{etag}" in tags
+
 @app.get("/products")
 async def get_products(
+    request: Request,
     category: Optional[str] = None,
     max_price: Optional[float] = None,
-    tags: Optional[str] = None
+    tags: Optional[str] = None,
+    fields: Optional[str] = None,
+    sort: str = "id",
+    limit: int = PRODUCTS_PAGE_SIZE,
+    cursor: Optional[str] = None
 ):
-    """Get products with optional filters"""
+    """Get a page of products with optional filters.
+    
+    ``sort`` is id, price, rating or name (``-`` prefix for descending),
+    ``fields`` a comma-separated projection (id is always included) and
+    ``cursor`` the ``next_cursor`` of the previous page. Responses carry
+    the catalog version as ETag, so unchanged pages revalidate with a 304.
+    """
     try:
+        snapshot = catalog.current()
+        etag = f'"catalog-{snapshot.version}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        
+        sort_field = sort.lstrip('-')
+        if sort_field not in snapshot.SORT_FIELDS:
+            raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(snapshot.SORT_FIELDS)}")
+        columns = snapshot.columns
+        if fields:
+            columns = ['id'] + [field for field in dict.fromkeys(fields.split(',')) if field and field != 'id']
+            unknown = [field for field in columns if field not in snapshot.columns]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        
         tag_list = tags.split(',') if tags else None
-        products = db_manager.get_products(category, max_price, tag_list)
-        return {"products": products}
+        rows, next_position = snapshot.page(
+            snapshot.matching(category, max_price, tag_list),
+            sort=sort_field,
+            descending=sort.startswith('-'),
+            after=decode_cursor(cursor, sort) if cursor else None,
+            limit=max(1, min(limit, PRODUCTS_MAX_PAGE_SIZE))
+        )
+        return JSONResponse({
+            "products": [snapshot.project(row, columns) for row in rows],
+            "next_cursor": encode_cursor(sort, next_position) if next_position else None,
+        }, headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching products: {str(e)}")
 
+def sync_product_index(product_id: int, product: Optional[Dict]):
+    """Apply a catalog edit to the search index and the catalog snapshot, and drop cached
+    responses that mention the product; blocking, so handlers run it in the threadpool"""
+    if product is not None and product.get('availability'):
+        ai_engine.upsert_products([product])
+    else:
+        ai_engine.remove_products([product_id])
+    ai_engine.response_cache.invalidate_products([product_id])
+    catalog.apply(product_id)
+
+def index_reloaded_products(snapshot: CatalogSnapshot):
+    """Index available products that reached this process only through catalog polling
+    (added by another worker or the import CLI), so they score on text without a restart"""
+    available = snapshot.view(np.flatnonzero(snapshot.available))
+    missing = ai_engine.unindexed_products(available.column('ids').tolist())
+    if missing:
+        new = available.subset(np.isin(available.column('ids'), missing))
+        print(f"🔄 Indexed {ai_engine.upsert_products(new.to_list())} products added outside this process")
+
+catalog.on_reload = index_reloaded_products
+
+@app.post("/products")
+async def create_product(product: ProductCreate):
+    """Add a product and index it without a restart"""
+    try:
+        product_id = db_manager.add_product(product.dict())
+        created = db_manager.get_product(product_id)
+        await run_in_threadpool(sync_product_index, product_id, created)
+        return {"product": created}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating product: {str(e)}")
+
+@app.post("/products/import")
+async def import_catalog(file: UploadFile = File(...), format: Optional[str] = None):
+    """Bulk upsert products (keyed on sku) from a CSV or JSONL upload, then update the index once"""
+    try:
+        stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+        summary = await run_in_threadpool(
+            import_products, db_manager, stream, format or detect_format(file.filename or "")
+        )
+        product_ids = summary.pop('product_ids')
+        
+        # One incremental index update for the whole import instead of a refit
+        snapshot = await run_in_threadpool(catalog.refresh)
+        imported = snapshot.view(np.flatnonzero(np.isin(snapshot.ids, product_ids)))
+        available = imported.subset(imported.column('available'))
+        unavailable = imported.subset(~imported.column('available'))
+        summary['indexed'] = await run_in_threadpool(ai_engine.upsert_products, available.to_list())
+        await run_in_threadpool(ai_engine.remove_products, unavailable.column('ids').tolist())
+        ai_engine.response_cache.invalidate_products(product_ids)
+        return summary
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error importing products: {str(e)}")
+
+@app.patch("/products/{product_id}")
+async def update_product(product_id: int, fields: ProductUpdate):
+    """Update a product (price, stock, text...) and patch the index in place"""
+    changes = fields.dict(exclude_unset=True)
+    nulls = [field for field in NON_NULLABLE_PRODUCT_FIELDS if field in changes and changes[field] is None]
+    if nulls:
+        raise HTTPException(status_code=422, detail=f"Fields cannot be null: {', '.join(nulls)}")
+    try:
+        updated = db_manager.update_product(product_id, changes)
+        if updated is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        await run_in_threadpool(sync_product_index, product_id, updated)
+        return {"product": updated}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error updating product: {str(e)}")
+
+@app.delete("/products/{product_id}")
+async def delete_product(product_id: int):
+    """Remove a product from the catalog and the index"""
+    try:
+        if not db_manager.delete_product(product_id):
+            raise HTTPException(status_code=404, detail="Product not found")
+        await run_in_threadpool(sync_product_index, product_id, None)
+        return {"message": "Product deleted"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting product: {str(e)}")
+
+@app.get("/index/stats")
+async def index_stats():
+    """Size and drift of the TF-IDF search index"""
+    return ai_engine.index_stats()
+
 @app.get("/categories")
 async def get_categories():
     """Get available product categories"""
@@ -146,6 +479,56 @@ async def update_user_preferences(user_id: str, preferences: Dict):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating preferences: {str(e)}")
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters of the LLM and query vector caches"""
+    return {
+        "preference_cache": ai_engine.preference_cache.stats(),
+        "response_cache": ai_engine.response_cache.stats(),
+        "query_vectors": ai_engine.query_vector_cache.stats(),
+        "query_encoder": ai_engine.dense.batcher.stats() if ai_engine.dense else None
+    }
+
+@app.get("/logs/stats")
+async def log_stats():
+    """Queue depth and counters of the recommendation log writer, plus partition storage"""
+    return {
+        "writer": log_writer.stats(),
+        "storage": log_store.stats() if log_store else None
+    }
+
+@app.get("/analytics/top-queries")
+async def analytics_top_queries(days: int = 7, limit: int = 20):
+    """Most frequent queries over the last days"""
+    try:
+        return {"days": days, "queries": analytics.top_queries(days, limit)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching analytics: {str(e)}")
+
+@app.get("/analytics/products")
+async def analytics_products(days: int = 7, limit: int = 20):
+    """Products recommended most often, with their average confidence"""
+    try:
+        return {"days": days, "products": analytics.product_impressions(days, limit)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching analytics: {str(e)}")
+
+@app.get("/analytics/categories")
+async def analytics_categories(days: int = 7):
+    """Average recommendation confidence per product category"""
+    try:
+        return {"days": days, "categories": analytics.category_confidence(days)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching analytics: {str(e)}")
+
+@app.get("/analytics/budgets")
+async def analytics_budgets(days: int = 7):
+    """Distribution of requested budgets"""
+    try:
+        return {"days": days, "budgets": analytics.budget_distribution(days)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching analytics: {str(e)}")
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
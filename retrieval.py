@@ -0,0 +1,88 @@
+from typing import List, Sequence
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+
+class BM25Index:
+    """Inverted index over product text with precomputed BM25 weights.
+
+    Documents are tokenized once with a ``CountVectorizer``; every (document,
+    term) weight is computed up front and stored term-major (CSC), so scoring
+    a query only touches the posting lists of its terms, however large the
+    catalog is. The raw term counts are kept too, so ``replace`` can swap a
+    few documents without tokenizing the rest again.
+    """
+
+    def __init__(self, documents: Sequence[str], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        vectorizer = CountVectorizer(stop_words='english', token_pattern=r'(?u)\b\w+\b', dtype=np.float32)
+        self._analyzer = vectorizer.build_analyzer()
+        try:
+            tf = vectorizer.fit_transform(documents).tocsr()
+            self.vocabulary = dict(vectorizer.vocabulary_)
+        except ValueError:  # empty catalog, or no indexable words at all
+            tf = sparse.csr_matrix((len(documents), 0), dtype=np.float32)
+            self.vocabulary = {}
+        self._weigh(tf)
+
+    def _weigh(self, tf: sparse.csr_matrix):
+        """BM25 weights from raw term counts (documents x vocabulary)"""
+        self.tf = tf
+        self.size = tf.shape[0]
+        if not tf.nnz:
+            self.weights = None
+            return
+
+        lengths = np.asarray(tf.sum(axis=1)).ravel()
+        average_length = lengths.mean() or 1.0
+        document_frequency = np.bincount(tf.indices, minlength=tf.shape[1])
+        idf = np.log(1 + (self.size - document_frequency + 0.5) / (document_frequency + 0.5))
+
+        rows = np.repeat(np.arange(self.size), np.diff(tf.indptr))
+        norm = self.k1 * (1 - self.b + self.b * lengths[rows] / average_length)
+        weights = tf.copy()
+        weights.data = (idf[tf.indices] * tf.data * (self.k1 + 1) / (tf.data + norm)).astype(np.float32)
+        self.weights = weights.tocsc()
+
+    def replace(self, start: int, stop: int, documents: Sequence[str]) -> "BM25Index":
+        """Copy of the index with documents ``start:stop`` replaced by ``documents``.
+
+        Only the new documents are tokenized (new words extend the
+        vocabulary); the weights are recomputed from the stored counts, since
+        idf and the average length depend on every document.
+        """
+        vocabulary = dict(self.vocabulary)
+        rows, columns = [], []
+        for row, document in enumerate(documents):
+            for token in self._analyzer(document):
+                rows.append(row)
+                columns.append(vocabulary.setdefault(token, len(vocabulary)))
+        replacement = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=(len(documents), len(vocabulary))
+        )
+        replacement.sum_duplicates()
+        tf = sparse.csr_matrix((self.tf.data, self.tf.indices, self.tf.indptr),
+                               shape=(self.size, len(vocabulary)))
+
+        index = object.__new__(BM25Index)
+        index.k1, index.b, index._analyzer, index.vocabulary = self.k1, self.b, self._analyzer, vocabulary
+        index._weigh(sparse.vstack([tf[:start], replacement, tf[stop:]], format='csr', dtype=np.float32))
+        return index
+
+    def terms(self, text: str) -> List[int]:
+        """Distinct vocabulary ids of the words in text"""
+        if self.weights is None or not text:
+            return []
+        return list(dict.fromkeys(self.vocabulary[token] for token in self._analyzer(text) if token in self.vocabulary))
+
+    def scores(self, term_ids: Sequence[int]) -> np.ndarray:
+        """BM25 score of every document for a query made of the given terms"""
+        if self.weights is None or not len(term_ids):
+            return np.zeros(self.size, dtype=np.float32)
+        return np.asarray(self.weights[:, list(term_ids)].sum(axis=1), dtype=np.float32).ravel()
+
+    def score_text(self, text: str) -> np.ndarray:
+        return self.scores(self.terms(text))
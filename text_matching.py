@@ -0,0 +1,99 @@
+from collections import deque
+from typing import List, Set
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton reporting which of a fixed set of keywords occur in a text.
+
+    Built once at startup; a lookup walks the text a single time no matter
+    how many keywords are registered, instead of one ``in`` check per keyword.
+    """
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = list(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [set()]
+
+        # Build the keyword trie
+        for pattern_id, pattern in enumerate(self.patterns):
+            node = 0
+            for char in pattern:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(set())
+                    self._goto[node][char] = next_node
+                node = next_node
+            self._out[node].add(pattern_id)
+
+        # Breadth-first pass to set failure links and merge outputs
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] |= self._out[self._fail[child]]
+
+    def matches(self, text: str) -> Set[int]:
+        """Return the ids (positions in ``patterns``) of every keyword found in text"""
+        found = set(self._out[0])
+        node = 0
+        for char in text:
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            if self._out[node]:
+                found |= self._out[node]
+        return found
+
+
+class SubstringIndex:
+    """Trigram inverted index over a fixed vocabulary of terms for substring lookups.
+
+    ``containing`` finds the terms a query occurs in by intersecting the
+    posting lists of the query's trigrams and verifying the few survivors;
+    ``contained_in`` finds the terms occurring in a text by looking up each
+    of its substrings. Neither scans the vocabulary.
+    """
+
+    def __init__(self, terms: List[str]):
+        self.terms = list(terms)
+        self._ids = {term: term_id for term_id, term in enumerate(self.terms)}
+        self._lengths = sorted({len(term) for term in self.terms})
+        self._postings = {}
+        for term_id, term in enumerate(self.terms):
+            for gram in self._trigrams(term):
+                self._postings.setdefault(gram, set()).add(term_id)
+
+    @staticmethod
+    def _trigrams(text: str) -> Set[str]:
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def containing(self, query: str) -> Set[int]:
+        """Ids of the terms that contain query"""
+        grams = self._trigrams(query)
+        if not grams:
+            # Too short for a trigram: fall back to checking every term
+            return {term_id for term_id, term in enumerate(self.terms) if query in term}
+        postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+        candidates = set.intersection(*postings)
+        return {term_id for term_id in candidates if query in self.terms[term_id]}
+
+    def contained_in(self, text: str) -> Set[int]:
+        """Ids of the terms that occur in text"""
+        found = set()
+        for length in self._lengths:
+            if length > len(text):
+                break
+            for start in range(len(text) - length + 1):
+                term_id = self._ids.get(text[start:start + length])
+                if term_id is not None:
+                    found.add(term_id)
+        return found